@@ -32,6 +32,16 @@ def main():
     parser.add_argument('-s','--server', help='Run as server', action='store_true')
     parser.add_argument('-x','--debuglevel', help='Debug Level')
     parser.add_argument('-z','--dropprob', help='Drop Probability')
+    parser.add_argument('-w','--window', help='Send window in packets')
+    parser.add_argument('-k','--dupacks', help='Duplicate ACKs before a fast retransmit, 0 = off')
+    parser.add_argument('-b','--burst', help='Packets sent per loop before receiving, default 1')
+    parser.add_argument('-r','--selective', help='Ask for selective repeat instead of go back N', action='store_true')
+    parser.add_argument('-c','--congestion', help='Congestion control: newreno (default), cubic or vegas')
+    parser.add_argument('-a','--pacing', help='Pace packets out over the RTT instead of sending bursts', action='store_true')
+    parser.add_argument('-v','--recvbuffer', help='Receive buffer in bytes, turns on receive window flow control')
+    parser.add_argument('-e','--ackevery', help='In order packets per ACK, 1 turns delayed ACKs off')
+    parser.add_argument('-m','--mss', help='Largest payload per packet, longer messages are sent in segments')
+    parser.add_argument('-g','--batch', help='Send and receive packets in batches, with UDP GSO, sendmmsg and recvmmsg where there are', action='store_true')
         
     # get the arguments into local variables 
     args = vars(parser.parse_args())
@@ -79,15 +89,42 @@ def main():
     # for each line, take a time-stamp, send and recive the line, update the list of RTT times,
     # and then update the MD5 hash of the sent and received data
 
-    # the maximum packet size for this transfer is 4K
-    max_pkt_size = (4*1024)
     # set the debug level in the library
     s.set_random_seed(352)
     s.set_debug_level(debug_level)
     s.set_drop_prob(probability)
+
+    # sending a burst of packets before receiving keeps more than one packet
+    # in flight, so the window size matters
+    if (args['burst'] == None):
+        burst = 1
+    else:
+        burst = int(args['burst'])
+
+    # how many packets may be in flight before sendto waits for ACKs
+    if (args['window'] != None):
+        s.set_window(int(args['window']))
+    if (args['dupacks'] != None):
+        s.set_dupack_threshold(int(args['dupacks']))
+    if (args['selective']):
+        s.set_selective_repeat()
+    if (args['congestion'] != None):
+        s.set_congestion_control(args['congestion'])
+    if (args['pacing']):
+        s.set_pacing()
+    if (args['recvbuffer'] != None):
+        s.set_recv_buffer(int(args['recvbuffer']))
+        s.set_flow_control()
+    if (args['ackevery'] != None):
+        s.set_delayed_ack(int(args['ackevery']))
+    if (args['mss'] != None):
+        s.set_mss(int(args['mss']))
+    if (args['batch']):
+        s.set_batched_send()
+        s.set_batched_recv()
     
     # start time stamp to compute the bandwidth 
-    start_stamp = time.clock()
+    start_stamp = time.time()
 
     # run as a client or server 
     if (run_as_server):
@@ -95,6 +132,10 @@ def main():
         from_addr = s.accept()
     else:
         s.connect(dest_addr)
+
+    # each message of this transfer is one packet, as large as the path
+    # allows: the MSS from path MTU discovery, or -m
+    max_pkt_size = s.get_stats()['mss']
     
     # the first message is the file size to send 
     bytes_to_send = filesize
@@ -113,7 +154,8 @@ def main():
     i = 0 
     while ( (bytes_to_send > 0) or (bytes_to_receive > 0) ):
 
-        if (bytes_to_send >0):        
+        for b in range(burst):
+          if (bytes_to_send >0):        
             if (bytes_to_send >= max_pkt_size):
                 size_to_send = max_pkt_size 
             else:
@@ -127,7 +169,8 @@ def main():
             if ((i % 100) == 0 ):
                 print ".",
                 
-        if (bytes_to_receive > 0):
+        for b in range(burst):
+          if (bytes_to_receive > 0):
             recv_data = s.recvfrom(max_pkt_size)
             bytes_to_receive = bytes_to_receive - len(recv_data)
             mdhash_recv.update(recv_data)                    
@@ -140,7 +183,7 @@ def main():
     remote_digest = s.recvfrom(max_pkt_size)
 
     s.close()            
-    end_stamp = time.clock()
+    end_stamp = time.time()
     lapsed_seconds = float(end_stamp - start_stamp)
     fd.close()
 
@@ -164,6 +207,10 @@ def main():
     if (not failed):
         print( "%s: digest succeeded bandwidth %f Mbytes/sec" % (prog_name,bandwidth) )
 
+    # how the recovery code did
+    stats = s.get_stats()
+    print( "%s: dropped %d retransmits %d timeouts %d fast retransmits %d" % (prog_name,stats['dropped'],stats['retransmits'],stats['timeouts'],stats['fast_retransmits']) )
+
     # this makes sure all threads exit
     print('you reached the end of the rainbow')
     os._exit(1)
@@ -10,12 +10,40 @@ import time
 import struct 
 import md5
 import os 
+import threading
 import sock352
 
 
 MAX_SIZE = (63*1024)
 
 
+# echo the lines of one client, which first sends how many there are
+def echo(serverSock):
+    num_lines_str = serverSock.recvfrom(1000)
+    line_count = int(num_lines_str)
+    print ("server -- will echo %d lines " % (line_count))
+    
+    while (line_count > 0):
+        #Read from UDP socket into message, client address 
+        message = serverSock.recvfrom(MAX_SIZE)
+        print ("server -- got packet len %d line %s" % (len(message),message))
+        serverSock.sendto(message)
+        line_count = line_count - 1
+        print ("server -- %d lines to go " % (line_count))
+        
+    serverSock.close()
+
+# a worker of --workers: echo every client the kernel hands this process,
+# each in its own thread
+def serve(listener, debug_level, probability):
+    listener.set_random_seed(352)
+    listener.set_debug_level(debug_level)
+    listener.set_drop_prob(probability)
+    while (True):
+        (conn, address) = listener.accept()
+        thread = threading.Thread(target=echo, args=(conn,))
+        thread.daemon = True
+        thread.start()
 
 def main():
     # parse all the arguments to the client 
@@ -23,6 +51,7 @@ def main():
     parser.add_argument('-l','--localport', help='local sock352 UDP port', required=True)
     parser.add_argument('-x','--debuglevel', help='Debug Level')
     parser.add_argument('-z','--dropprob', help='Drop Probability')
+    parser.add_argument('-w','--workers', help='Echo any number of clients from this many processes sharing the port, until killed')
     
     args = vars(parser.parse_args())
     local_port =  int(args['localport'])
@@ -42,6 +71,17 @@ def main():
         probability =  float(args['dropprob'])
 
 
+    if (args['workers'] != None):
+        supervisor = sock352.Supervisor(('', local_port), lambda listener: serve(listener, debug_level, probability), int(args['workers']))
+        supervisor.start()
+        print ("server -- %d workers on port %d" % (int(args['workers']), local_port))
+        try:
+            supervisor.serve_forever()
+        finally:
+            print ("server -- %s" % (supervisor.get_stats()))
+            supervisor.stop()
+        return
+
     serverSock = sock352.Socket()
     serverSock.bind(('', local_port))
 
@@ -51,20 +91,7 @@ def main():
     serverSock.set_drop_prob(probability)
 
     from_addr = serverSock.accept()
-    
-    num_lines_str = serverSock.recvfrom(1000)
-    line_count = int(num_lines_str)
-    print ("server -- will echo %d lines " % (line_count))
-    
-    while (line_count > 0):
-        #Read from UDP socket into message, client address 
-        message = serverSock.recvfrom(MAX_SIZE)
-        print ("server -- got packet len %d line %s" % (len(message),message))
-        serverSock.sendto(message)
-        line_count = line_count - 1
-        print ("server -- %d lines to go " % (line_count))
-        
-    serverSock.close()
+    echo(serverSock)
 
 # this gives a main function in Python
 if __name__ == "__main__":
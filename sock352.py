@@ -17,9 +17,14 @@ import threading
 import time
 import sys
 import struct as st
+import collections
+import heapq
+import errno
 import os
 import signal
 import random
+import select
+import multiprocessing
 
 # The first byte of every packet must have this value
 MESSAGE_TYPE = 0x44
@@ -28,11 +33,19 @@ MESSAGE_TYPE = 0x44
 # ! = big endian, b = byte, L = long, H = half word
 HEADER_FMT = '!bbLLH'
 
+# the header format is compiled once here, every pack and unpack goes through
+# this object instead of building and parsing a new format string per packet
+HEADER_STRUCT = st.Struct(HEADER_FMT)
+HEADER_LEN = HEADER_STRUCT.size
+
 # this are the flags for the packet header 
 SYN =  0x01    # synchronize 
 ACK =  0x02    # ACK is valid 
 DATA = 0x04    # Data is valid 
 FIN =  0x08    # FIN = remote side called close 
+OPTIONS = 0x10 # a header extension with options follows the header
+PROBE = 0x20   # zero window probe, asks the receiver for its window
+MORE = 0x40    # more segments of the same message follow this one
 
 # max size of the data payload is 63 KB
 
@@ -42,6 +55,192 @@ MAX_SIZE = (63*1024)
 MAX_PKT = ((16+16+16)+(MAX_SIZE))
 MAX_SIZE = (63*1024)
 
+# retransmission timeout (RTO) estimator, RFC 6298 style. Times are in seconds
+RTO_INITIAL = 1.0
+RTO_MIN = 0.2
+RTO_MAX = 60.0
+RTT_ALPHA = 0.125
+RTT_BETA = 0.25
+RTO_K = 4
+
+# this many duplicate ACKs in a row trigger a fast retransmit
+DUPACK_THRESHOLD = 3
+
+# a connection is given up after this many retransmission timeouts in a row
+MAX_TIMEOUTS = 10
+
+# after close() has seen the remote FIN it waits at most this many RTOs for
+# the ACK of its own FIN
+CLOSE_LINGER_RTOS = 4
+
+# number of datagram slots the per socket receive ring starts with, it
+# grows when more are busy at once and goes back to this size when idle.
+# Beyond RECV_RING_MAX slots a slot that is given back is freed, not kept.
+RECV_RING_SLOTS = 2
+RECV_RING_MAX = 64
+# a message waiting to be read holds its ring slot, a whole MAX_PKT. Once the
+# ring has no free slot left, payloads shorter than this are copied out and
+# the slot given back instead.
+RECV_COPY_LIMIT = MAX_PKT // 4
+
+# default send window, in packets
+DEFAULT_WINDOW = 32
+
+# default number of connections that finished the handshake and wait for
+# accept() on a listening socket, more SYNs than that are ignored
+LISTEN_BACKLOG = 128
+
+# the SYN is sent again this many times, RTO_INITIAL apart at first and
+# twice as long every time, before connect() gives up. A listener resends
+# the SYN ACK of a half-open connection the same way SYNACK_RETRIES times
+# and then drops the connection.
+SYN_RETRIES = 6
+SYNACK_RETRIES = 5
+
+# SO_REUSEPORT lets listeners in several processes bind the same UDP port,
+# Linux hands each flow (by the addresses and ports of both ends) to one of
+# them. Python 2 has no name for it, 15 is its value on Linux.
+REUSEPORT_SUPPORTED = sys.platform.startswith('linux')
+SO_REUSEPORT = getattr(ip, 'SO_REUSEPORT', 15)
+
+# how often Supervisor.serve_forever looks for dead workers, in seconds
+SUPERVISE_INTERVAL = 1.0
+
+# default number of free objects a packet/skbuf pool keeps around
+PACKET_POOL_SIZE = 1024
+
+# the header extension, sent when the OPTIONS flag is set. It sits between the
+# header and the data: a version byte and the length of the options, then the
+# options as kind, length, value. The size field of the header still counts
+# only the data. Options of an unknown kind are skipped by their length, and
+# so is a whole extension of another version.
+EXT_VERSION = 1
+EXT_STRUCT = st.Struct('!BB')
+OPT_STRUCT = st.Struct('!BB')
+
+# option kinds
+OPT_SYN_OFFER = 1     # features the connecting side supports, in the SYN
+OPT_SYN_ACCEPT = 2    # features the accepting side agreed to, in the SYN ACK
+OPT_SACK = 3          # blocks of packets received above the cumulative ACK
+OPT_RWND = 4          # free bytes in the receive buffer of the sender
+OPT_PMTU = 5          # size of a path MTU probe, echoed back in the answer
+
+# the feature bits of OPT_SYN_OFFER/OPT_SYN_ACCEPT
+FEATURE_STRUCT = st.Struct('!H')
+FEATURE_SACK = 0x01   # selective repeat with SACK blocks
+FEATURE_RWND = 0x02   # receive window flow control
+FEATURE_SEGMENT = 0x04  # reassembly of messages sent in segments
+FEATURE_PMTU = 0x08   # answers to path MTU probes
+
+WINDOW_STRUCT = st.Struct('!L')
+
+# messages longer than the maximum segment size (MSS) go out in segments, so
+# no datagram is fragmented by IP, where losing one fragment loses all of it.
+# The default fits an Ethernet MTU after the IP and UDP headers, our header
+# and the window option a data packet may carry.
+DEFAULT_MTU = 1500
+IP_UDP_HEADER_LEN = 28
+DATA_OPTIONS_LEN = EXT_STRUCT.size + OPT_STRUCT.size + WINDOW_STRUCT.size
+DATA_OVERHEAD = IP_UDP_HEADER_LEN + HEADER_LEN + DATA_OPTIONS_LEN
+DEFAULT_MSS = DEFAULT_MTU - DATA_OVERHEAD
+
+# path MTU discovery, Linux only. Right after the handshake each side sends
+# probes padded to a size with the DF bit set (IP_PMTUDISC_PROBE, which also
+# ignores the kernel's own PMTU guess), the other side echoes the size of each
+# one that arrives. The route MTU is tried first, then a binary search down
+# to PMTU_MIN, which every IPv4 path carries.
+PMTU_SUPPORTED = sys.platform.startswith('linux')
+IP_MTU_DISCOVER = getattr(ip, 'IP_MTU_DISCOVER', 10)
+IP_PMTUDISC_PROBE = getattr(ip, 'IP_PMTUDISC_PROBE', 3)
+IP_MTU = getattr(ip, 'IP_MTU', 14)
+PMTU_STRUCT = st.Struct('!H')
+PMTU_PROBE_OVERHEAD = IP_UDP_HEADER_LEN + HEADER_LEN + EXT_STRUCT.size + OPT_STRUCT.size + PMTU_STRUCT.size
+PMTU_MIN = 576
+PMTU_MAX = MAX_SIZE + DATA_OVERHEAD
+PMTU_PRECISION = 16
+PMTU_PROBE_TRIES = 2
+# a probe is given up after four RTTs, but at least this many seconds. Not
+# the RTO, whose floor is there for data and would make every size that is
+# too big cost a fifth of a second
+PMTU_PROBE_WAIT = 0.02
+# a path MTU found is used for this many seconds by every connection to
+# that host before it is probed again
+PMTU_CACHE_TIME = 600.0
+# the mss taken from a path MTU is at most PMTU_MSS_MAX, and with flow
+# control at most 1/PMTU_BUFFER_SHARE of the receive buffer. Loopback's 64K
+# MTU would otherwise let a few packets fill the kernel buffer or the
+# receive window. The kernel buffers are raised to hold a window of packets.
+PMTU_MSS_MAX = 32*1024
+PMTU_BUFFER_SHARE = 16
+
+# batched transmit (set_batched_send): new packets are collected and handed
+# to the kernel many per system call. With UDP generic segmentation offload
+# (Linux 4.18 and up) one sendmsg carries a run of equal size datagrams and
+# the kernel cuts them apart, otherwise sendmmsg(2) takes a list of them.
+SOL_UDP = 17
+UDP_SEGMENT = getattr(ip, 'UDP_SEGMENT', 103)
+GSO_SIZE_STRUCT = st.Struct('=H')
+GSO_MAX_SEGMENTS = 64
+GSO_MAX_BYTES = 65507
+# packets collected before the batch is sent without waiting for more
+SEND_BATCH = 64
+
+# batched receive (set_batched_recv): recvmmsg(2) reads up to RECV_BATCH
+# datagrams per system call, each straight into a slot of the receive ring.
+# The socket holds RECV_BATCH free slots for the next call, about 2 MB.
+RECV_BATCH = 32
+# ACKs of a batch go out together, so the sender answers with a burst. The
+# kernel receive buffer is raised to this (capped at net.core.rmem_max)
+RECV_BATCH_BUFFER = 4 * 1024 * 1024
+MSG_DONTWAIT = getattr(ip, 'MSG_DONTWAIT', 0x40)
+MSG_WAITFORONE = 0x10000
+
+# a SACK block is the first and last sequence number of a run of packets the
+# receiver holds, at most this many blocks go into one ACK
+SACK_STRUCT = st.Struct('!LL')
+MAX_SACK_BLOCKS = 4
+
+# a socket the scheduler thread reads for (see Socket.fileno) is serviced
+# this many datagrams at a time, then the timers get a turn
+SERVICE_BATCH = 64
+
+# how far past the next expected packet the selective repeat receiver buffers
+REORDER_LIMIT = 1024
+
+# bytes of received data the library holds for the application before the
+# advertised receive window closes
+RECV_BUFFER = 128*1024
+
+# bytes sendto queues for the engine (set_engine) before it waits
+SEND_BUFFER = 128*1024
+
+# delayed ACKs: one cumulative ACK for every ACK_EVERY packets received in
+# order, or DELACK_TIMEOUT seconds after the first one not yet ACKed
+ACK_EVERY = 2
+DELACK_TIMEOUT = 0.04
+
+# congestion window at the start of a connection and the slow start threshold
+# before the first loss, in packets
+INITIAL_CWND = 10
+INITIAL_SSTHRESH = 65535
+
+# CUBIC constants, RFC 8312
+CUBIC_C = 0.4
+CUBIC_BETA = 0.7
+
+# Vegas keeps between VEGAS_ALPHA and VEGAS_BETA packets queued in the
+# network, and leaves slow start once more than VEGAS_GAMMA are queued
+VEGAS_ALPHA = 2
+VEGAS_BETA = 4
+VEGAS_GAMMA = 1
+
+# pacing spreads a window of packets over one smoothed RTT. The rate is
+# cwnd/srtt times the gain (higher in slow start so the window can still
+# grow), and up to PACING_BURST packets may go out back to back
+PACING_SS_GAIN = 2.0
+PACING_CA_GAIN = 1.0
+PACING_BURST = 1.0
+
 # these are the socket states 
 STATE_INIT = 1
 STATE_SYNSENT = 2
@@ -52,8 +251,6 @@ STATE_CLOSING =  6
 STATE_CLOSED =   7
 STATE_REMOTE_CLOSED = 8
 
-list_of_outstanding_packets = []
-
 # function to . Higher debug levels are more detail
 # highly recommended 
 def dbg_print(level,string):
@@ -64,9 +261,84 @@ def dbg_print(level,string):
 
 
 
+# codec layer for the wire format. The header is read in place with unpack_from
+# and the payload comes back as a slice of the buffer that was passed in, so a
+# memoryview buffer gives a payload view without copying the data.
+# returns None if the buffer is too short to hold a header
+def unpack_packet_from(buffer, offset=0, nbytes=None):
+    if (nbytes == None):
+        nbytes = len(buffer) - offset
+    if (nbytes < HEADER_LEN):
+        return None
+    (ptype, cntl, seq, ack, size) = HEADER_STRUCT.unpack_from(buffer, offset)
+    data = buffer[offset + HEADER_LEN:offset + nbytes]
+    return (ptype, cntl, seq, ack, size, data)
+
+# write a header and payload into a caller supplied buffer (bytearray or
+# writable memoryview) starting at offset. Returns the number of bytes written.
+def pack_packet_into(buffer, offset, ptype, cntl, seq, ack, size, data):
+    HEADER_STRUCT.pack_into(buffer, offset, ptype, cntl, seq, ack, size)
+    start = offset + HEADER_LEN
+    if (data):
+        end = start + len(data)
+        buffer[start:end] = data
+        return end - offset
+    return HEADER_LEN
+
+# encode a dictionary of option kind -> value bytes as a header extension
+def pack_options(options):
+    body = b''.join([OPT_STRUCT.pack(kind, len(value)) + value for (kind, value) in options.items()])
+    return EXT_STRUCT.pack(EXT_VERSION, len(body)) + body
+
+# split the header extension off the front of a payload. Returns the options
+# as a dictionary of kind -> value (slices of the buffer) and the data after
+# the extension. A truncated extension, or one of a version we do not know,
+# gives no options.
+def unpack_options(buffer):
+    options = {}
+    if (len(buffer) < EXT_STRUCT.size):
+        return (options, buffer)
+    (version, length) = EXT_STRUCT.unpack_from(buffer)
+    end = EXT_STRUCT.size + length
+    if (end > len(buffer)):
+        return (options, buffer[len(buffer):])
+    if (version != EXT_VERSION):
+        return (options, buffer[end:])
+    offset = EXT_STRUCT.size
+    while (offset + OPT_STRUCT.size <= end):
+        (kind, size) = OPT_STRUCT.unpack_from(buffer, offset)
+        offset += OPT_STRUCT.size
+        if (offset + size > end):
+            break
+        options[kind] = buffer[offset:offset + size]
+        offset += size
+    return (options, buffer[end:])
+
+# the feature bits in an OPT_SYN_OFFER/OPT_SYN_ACCEPT option of a packet, 0 if
+# the packet does not carry that option
+def packet_features(packet, kind):
+    if (packet.options == None) or (kind not in packet.options):
+        return 0
+    value = packet.options[kind]
+    if (len(value) < FEATURE_STRUCT.size):
+        return 0
+    return FEATURE_STRUCT.unpack_from(value)[0]
+
+def pack_sack(blocks):
+    return b''.join([SACK_STRUCT.pack(start, end) for (start, end) in blocks])
+
+def unpack_sack(value):
+    count = len(value) // SACK_STRUCT.size
+    return [SACK_STRUCT.unpack_from(value, i * SACK_STRUCT.size) for i in range(count)]
+
+
 # This class holds the data of a packet gets sent over the channel 
 # 
-class Packet:
+# __slots__ keeps a Packet down to the fields below without a per instance
+# dictionary, which matters for long retransmission queues
+class Packet(object):
+    __slots__ = ('type', 'cntl', 'seq', 'ack', 'size', 'data', 'options')
+
     def __init__(self):
         self.type = MESSAGE_TYPE    # ID of sock352 packet
         self.cntl = 0               # control bits/flags 
@@ -74,41 +346,53 @@ class Packet:
         self.ack = 0                # acknowledgement number 
         self.size = 0               # size of the data payload 
         self.data = b''             # data 
+        self.options = None         # header extension options, kind -> value
+
+    # put every field back to its initial value, used when a packet is recycled
+    def reset(self):
+        self.type = MESSAGE_TYPE    # ID of sock352 packet
+        self.cntl = 0               # control bits/flags 
+        self.seq = 0                # sequence number 
+        self.ack = 0                # acknowledgement number 
+        self.size = 0               # size of the data payload 
+        self.data = b''             # data 
+        self.options = None         # header extension options, kind -> value
 
     # unpack a binary byte array into the Python fields of the packet 
     def unpack(self,bytes):
         # check that the data length is at least the size of a packet header 
-        data_len = (len(bytes) - st.calcsize('!bbLLH'))
-        if (data_len >= 0):
-
-            new_format = HEADER_FMT + str(data_len) + 's'
-            values = st.unpack(new_format,bytes)
-            self.type = values[0]
-            self.cntl = values[1]
-            self.seq  = values[2]
-            self.ack  = values[3]
-            self.size = values[4] 
-            self.data = values[5]
+        fields = unpack_packet_from(bytes)
+        if (fields != None):
+            (self.type, self.cntl, self.seq, self.ack, self.size, self.data) = fields
+            if (self.cntl & OPTIONS):
+                (self.options, self.data) = unpack_options(self.data)
             # you dont have to have to implement the the dbg_print function, but its highly recommended 
-            dbg_print (1,("sock352: unpacked:0x%x cntl:0x%x seq:0x%x ack:0x%x size:0x%x data:x%s" % (self.type,self.cntl,self.seq,self.ack,self.size,binascii.hexlify(self.data))))
+            if (sock352_dbg_level >= 1):
+                dbg_print (1,("sock352: unpacked:0x%x cntl:0x%x seq:0x%x ack:0x%x size:0x%x data:x%s" % (self.type,self.cntl,self.seq,self.ack,self.size,binascii.hexlify(self.data))))
         else:
-            dbg_print (2,("sock352 error: bytes to packet unpacker are too short len %d %d " % (len(bytes), st.calcsize('!bbLLH'))))
+            dbg_print (2,("sock352 error: bytes to packet unpacker are too short len %d %d " % (len(bytes), HEADER_LEN)))
 
         return
     
     # returns a byte array from the Python fields in a packet 
+    # the OPTIONS flag is set from whether the packet has options
     def pack(self):
-        if (self.data == None): 
-            data_len = 0
-        else:
-            data_len = len(self.data)
-        if (data_len == 0):
-            bytes = st.pack('!bbLLH',self.type,self.cntl,self.seq,self.ack,self.size)
+        if (self.options):
+            return HEADER_STRUCT.pack(self.type,self.cntl | OPTIONS,self.seq,self.ack,self.size) + pack_options(self.options) + self.data
+        cntl = self.cntl & ~OPTIONS
+        if (self.data):
+            if (sock352_dbg_level >= 5):
+                dbg_print(5,("cs352 pack: %d %d %d %d %d %s " % (self.type,cntl,self.seq,self.ack,self.size,self.data)))
+            bytes = HEADER_STRUCT.pack(self.type,cntl,self.seq,self.ack,self.size) + self.data
         else:
-            new_format = HEADER_FMT + str(data_len) + 's'  # create a new string '!bbLLH30s' 
-            dbg_print(5,("cs352 pack: %d %d %d %d %d %s " % (self.type,self.cntl,self.seq,self.ack,self.size,self.data)))
-            bytes = st.pack(new_format,self.type,self.cntl,self.seq,self.ack,self.size,self.data)
+            bytes = HEADER_STRUCT.pack(self.type,cntl,self.seq,self.ack,self.size)
         return bytes
+
+    # packs the packet into a caller supplied buffer, returns the length written
+    def pack_into(self,buffer,offset=0):
+        if (self.options):
+            return pack_packet_into(buffer,offset,self.type,self.cntl | OPTIONS,self.seq,self.ack,self.size,pack_options(self.options) + self.data)
+        return pack_packet_into(buffer,offset,self.type,self.cntl & ~OPTIONS,self.seq,self.ack,self.size,self.data)
     
     # this converts the fields in the packet into hexadecimal numbers 
     def toHexFields(self):
@@ -132,70 +416,1312 @@ class Packet:
 # it must work against the class client and servers
 # with various drop rates
 
-def resendPackets(delay,self):
-    time.sleep(delay)
-   # ('im here')
-    # there is a global socket list, although only 1 socket is supported for now
-    while (True):
-        #('im here')
-        time.sleep(delay)
-        # example
-        for packet in list_of_outstanding_packets:
-
-            current_time = time.time()
-            time_diff = float(current_time) - float(packet.time_sent)
-
-
-            dbg_print(5, "sock352: packet timeout diff %.3f %f %f " % (time_diff, current_time, packet.time_sent))
-            if (time_diff > delay):
-                newPackedPacket = packet.Packet
-                newPackedPacket1 = newPackedPacket.pack()
-               # ('Packet is being retransmitted')
-                dbg_print(3, "sock352: packet timeout, retransmitting")
-                if (self.serveraddress == 0):
-                    self.mysocket.sendto(newPackedPacket1, self.clientaddress)
+# a timer handed out by the scheduler, the callback is called as
+# func(timer, *args) so it can tell whether it is still the timer it armed
+class Timer(object):
+    __slots__ = ('when', 'func', 'args', 'active')
+
+    def __init__(self, when, func, args):
+        self.when = when
+        self.func = func
+        self.args = args
+        self.active = True
+
+# waits for any of a set of file descriptors to be readable, with poll(2)
+# where there is one
+class Poller(object):
+    def __init__(self):
+        self.fds = set()
+        self.poll = None
+        if (hasattr(select, 'poll')):
+            self.poll = select.poll()
+
+    def register(self, fd):
+        self.fds.add(fd)
+        if (self.poll != None):
+            self.poll.register(fd, select.POLLIN)
+
+    def unregister(self, fd):
+        self.fds.discard(fd)
+        if (self.poll != None):
+            try:
+                self.poll.unregister(fd)
+            except KeyError:
+                pass
+
+    # the readable descriptors, waiting at most timeout seconds (None for
+    # no limit)
+    def wait(self, timeout):
+        try:
+            if (self.poll != None):
+                if (timeout != None):
+                    timeout = max(int(timeout * 1000) + 1, 0)
+                return [fd for (fd, event) in self.poll.poll(timeout)]
+            return select.select(list(self.fds), [], [], timeout)[0]
+        except (select.error, OSError, IOError) as e:
+            if (e.args[0] == errno.EINTR):
+                return []
+            raise
+
+# one scheduler thread serves the timers of every socket in the process. Timers
+# sit in a heap ordered by expiry time and the thread sleeps until the earliest
+# one is due, so the work done is per expiring timer, not per outstanding
+# packet. Cancelled timers are left in the heap and skipped when they come up.
+# The thread also reads the UDP sockets that are watched: while it waits for
+# the next timer it polls them, and calls service() on the ones that are
+# readable. A socketpair wakes it from poll when that wait has to be cut short.
+class TimerScheduler(object):
+    def __init__(self):
+        self.heap = []
+        self.counter = 0
+        self.live = 0
+        self.cond = threading.Condition()
+        self.thread = None
+        self.watched = {}
+        self.poller = None
+        self.waker = None
+        self.polling = False
+
+    def startthread(self):
+        if (self.thread == None):
+            self.thread = threading.Thread(target=self.run)
+            self.thread.daemon = True
+            self.thread.start()
+
+    # get the thread to look at the heap and the watched sockets again,
+    # called with the cond held
+    def wake(self):
+        self.cond.notify()
+        if (self.polling):
+            try:
+                self.waker[1].send(b'\0')
+            except (ip.error, OSError):
+                # the socketpair is full, the thread has plenty to wake it
+                pass
+
+    # call sock.service() whenever its UDP socket is readable
+    def watch(self, sock):
+        with self.cond:
+            if (self.waker == None):
+                self.waker = ip.socketpair()
+                self.waker[0].setblocking(False)
+                self.waker[1].setblocking(False)
+                self.poller = Poller()
+                self.poller.register(self.waker[0].fileno())
+            fd = sock.mysocket.fileno()
+            self.watched[fd] = sock
+            self.poller.register(fd)
+            self.startthread()
+            self.wake()
+
+    def unwatch(self, sock):
+        with self.cond:
+            fd = sock.mysocket.fileno()
+            if (self.watched.get(fd) is sock):
+                del self.watched[fd]
+                self.poller.unregister(fd)
+                self.wake()
+
+    # run func(timer, *args) on the scheduler thread at time.time() >= when
+    def schedule(self, when, func, *args):
+        timer = Timer(when, func, args)
+        with self.cond:
+            self.counter += 1
+            heapq.heappush(self.heap, (when, self.counter, timer))
+            self.live += 1
+            self.startthread()
+            # only wake the thread up if this is now the earliest timer
+            if (self.heap[0][2] is timer):
+                self.wake()
+        return timer
+
+    def cancel(self, timer):
+        with self.cond:
+            if (timer.active):
+                timer.active = False
+                self.live -= 1
+                # don't let cancelled timers pile up in the heap
+                if (len(self.heap) > 64) and (self.live < len(self.heap) // 4):
+                    self.heap = [entry for entry in self.heap if entry[2].active]
+                    heapq.heapify(self.heap)
+
+    # number of timers armed and not yet fired or cancelled
+    def pending(self):
+        return self.live
+
+    def run(self):
+        while (True):
+            timer = None
+            with self.cond:
+                while (len(self.heap) > 0) and (not self.heap[0][2].active):
+                    heapq.heappop(self.heap)
+                delay = None
+                if (len(self.heap) > 0):
+                    delay = self.heap[0][0] - time.time()
+                if (delay != None) and (delay <= 0):
+                    timer = heapq.heappop(self.heap)[2]
+                    timer.active = False
+                    self.live -= 1
+                elif (len(self.watched) == 0):
+                    self.cond.wait(delay)
+                    continue
                 else:
-                    a = 6
-                    self.mysocket.sendto(newPackedPacket1, self.serveraddress)
+                    self.polling = True
+            if (timer != None):
+                try:
+                    timer.func(timer, *timer.args)
+                except Exception as e:
+                    dbg_print(1, "sock352: timer callback failed %s" % (e))
+                    self.failed(getattr(timer.func, '__self__', None), e)
+                continue
+            ready = self.poller.wait(delay)
+            socks = []
+            with self.cond:
+                self.polling = False
+                for fd in ready:
+                    if (fd == self.waker[0].fileno()):
+                        try:
+                            while (self.waker[0].recv(4096)):
+                                pass
+                        except (ip.error, OSError):
+                            pass
+                    elif (fd in self.watched):
+                        socks.append(self.watched[fd])
+            for sock in socks:
+                try:
+                    sock.service()
+                except Exception as e:
+                    dbg_print(1, "sock352: service failed %s" % (e))
+                    self.failed(sock, e)
+
+    # nobody waits on the scheduler thread for an error, it is handed to the
+    # socket the timer or service call was for, whose next call raises it
+    def failed(self, sock, error):
+        seterror = getattr(sock, 'seterror', None)
+        if (seterror != None):
+            seterror(error)
+
+# the scheduler shared by every socket
+scheduler = TimerScheduler()
+
+# a child forked after the thread started has none of it, only a copy of the
+# heap and maybe of a held lock. It starts over with no timers, sockets
+# should be made after the fork.
+def restart_scheduler():
+    scheduler.__init__()
+
+if (hasattr(os, 'register_at_fork')):
+    os.register_at_fork(after_in_child=restart_scheduler)
+
+# how many timers are armed across all sockets, for monitoring
+def pending_timers():
+    return scheduler.pending()
+
+class skbuf(object):
+    __slots__ = ('Packet', 'time_sent', 'retransmitted', 'sacked')
+
+    def __init__(self, Packet=None, time_sent=0):
+        self.Packet = Packet
+        self.time_sent = time_sent
+        self.retransmitted = False
+        self.sacked = False
+
+    def reset(self):
+        self.Packet = None
+        self.time_sent = 0
+        self.retransmitted = False
+        self.sacked = False
+
+# a freelist of recycled objects (Packets or skbufs). get() hands back a
+# recycled object if there is one and builds a new one otherwise. put() takes
+# an object back once nothing references it any more, that is after it has been
+# ACKed or the receive path is done with it. hits and misses count how often
+# get() could recycle.
+class ObjectPool(object):
+    def __init__(self, factory, maxsize=PACKET_POOL_SIZE):
+        self.factory = factory
+        self.maxsize = maxsize
+        self.free = []
+        self.hits = 0
+        self.misses = 0
+
+    # the thread reading packets takes them without the iocond, so
+    # another may empty the list between a check and the pop
+    def get(self):
+        try:
+            obj = self.free.pop()
+        except IndexError:
+            self.misses += 1
+            return self.factory()
+        self.hits += 1
+        return obj
+
+    def put(self, obj):
+        obj.reset()
+        if (len(self.free) < self.maxsize):
+            self.free.append(obj)
+
+    def stats(self):
+        return {'size': len(self.free), 'hits': self.hits, 'misses': self.misses}
+
+# the receive ring is a set of MAX_PKT sized slots. Datagrams are read
+# straight into a free slot with recvfrom_into and the payload is handed out
+# as a memoryview of the slot, so the receive loop does not allocate a new
+# buffer for every packet. A slot is busy from acquire() until release().
+# The ring starts with a few slots and grows by one whenever every slot is
+# busy, a slot once allocated is reused. Past limit slots a released slot
+# is freed, and once at most one is busy (the slot of a read waiting for a
+# datagram) the ring goes back to its starting size.
+# The number of a freed slot is used again by the next one allocated, and
+# generation counts the frees so a cached address of a slot can be checked.
+# The fast paths are single deque operations, which the thread reading and
+# the threads releasing may do at the same time. Growing and freeing take
+# the lock.
+class RecvRing:
+    def __init__(self, slots=RECV_RING_SLOTS, slot_size=MAX_PKT, limit=RECV_RING_MAX):
+        self.slot_size = slot_size
+        self.initial = slots
+        self.limit = max(limit, slots)
+        self.buffers = []
+        self.slots = []
+        self.free = collections.deque()
+        # numbers of freed slots, how many slots have a buffer
+        self.unused = []
+        self.allocated = 0
+        self.generation = 0
+        self.lock = threading.Lock()
+        for i in range(slots):
+            self.free.append(self.grow())
+
+    # add a slot, returns its number
+    def grow(self):
+        with self.lock:
+            buffer = bytearray(self.slot_size)
+            self.allocated += 1
+            if (len(self.unused) > 0):
+                slot = self.unused.pop()
+                self.buffers[slot] = buffer
+                self.slots[slot] = memoryview(buffer)
+                return slot
+            self.buffers.append(buffer)
+            self.slots.append(memoryview(buffer))
+            return len(self.slots) - 1
+
+    def acquire(self):
+        try:
+            return self.free.popleft()
+        except IndexError:
+            return self.grow()
+
+    def release(self, slot):
+        if (self.allocated > self.limit):
+            self.drop(slot)
+            return
+        self.free.append(slot)
+        if (self.allocated > self.initial) and (self.busy() <= 1):
+            self.shrink()
+
+    # free the buffer of a slot nobody holds
+    def drop(self, slot):
+        with self.lock:
+            self.buffers[slot] = None
+            self.slots[slot] = None
+            self.unused.append(slot)
+            self.allocated -= 1
+            self.generation += 1
+
+    def shrink(self):
+        while (self.allocated > self.initial):
+            try:
+                slot = self.free.pop()
+            except IndexError:
+                return
+            self.drop(slot)
+
+    # slots with a buffer that are busy
+    def busy(self):
+        return self.allocated - len(self.free)
+
+    # the bytearray a slot lives in and where in it the slot starts
+    def backing(self, slot):
+        return (self.buffers[slot], 0)
+
+# congestion control. Each socket has one of these, it keeps the congestion
+# window (cwnd) in packets and the socket never has more than cwnd packets in
+# flight. The socket calls, with its lock held:
+#   onack(acked, rtt)    acked new packets were ACKed, rtt is an RTT sample
+#                        in seconds or None
+#   onloss(inflight)     a fast retransmit, at most once per window of data
+#   ontimeout(inflight)  the retransmission timer went off
+# This base class is NewReno: slow start up to ssthresh, then one more packet
+# per window of ACKs, and cwnd halved on a loss.
+class CongestionControl(object):
+    name = 'newreno'
 
+    def __init__(self):
+        self.cwnd = float(INITIAL_CWND)
+        self.ssthresh = float(INITIAL_SSTHRESH)
 
-    return
+    # the number of packets that may be in flight
+    def window(self):
+        return max(int(self.cwnd), 1)
 
-    pass
-class transmittingThread(threading.Thread):
-        def __init__(self,delay,mysocket,clientaddress,serveraddress):
-            threading.Thread.__init__(self)
-            self.delay = delay
-            self.mysocket = mysocket
-            self.clientaddress = clientaddress
-            self.serveraddress = serveraddress
+    def slowstart(self, acked):
+        self.cwnd += acked
 
-        def run(self):
-            resendPackets(self.delay,self)
-            return
+    def onack(self, acked, rtt):
+        if (self.cwnd < self.ssthresh):
+            self.slowstart(acked)
+        else:
+            self.cwnd += float(acked) / self.cwnd
 
-class skbuf:
-    def __init__(self, Packet, time_sent):
-        self.Packet = Packet
-        self.time_sent = time_sent
+    def onloss(self, inflight):
+        self.ssthresh = max(inflight / 2.0, 2.0)
+        self.cwnd = self.ssthresh
+
+    def ontimeout(self, inflight):
+        self.ssthresh = max(inflight / 2.0, 2.0)
+        self.cwnd = 1.0
+
+NewReno = CongestionControl
+
+# CUBIC: after a loss the window grows along a cubic curve in time since the
+# loss, flat around the window where the loss happened (wmax) and fast away
+# from it. It never grows slower than NewReno would.
+class Cubic(CongestionControl):
+    name = 'cubic'
 
-class Socket:
-    list_of_global_outstanding_packet = []
+    def __init__(self):
+        CongestionControl.__init__(self)
+        self.wmax = 0.0
+        self.epoch = None
+        self.k = 0.0
+        self.reno = 0.0
+
+    def onack(self, acked, rtt):
+        if (self.cwnd < self.ssthresh):
+            self.slowstart(acked)
+            return
+        now = time.time()
+        if (self.epoch == None):
+            # first ACK of a congestion avoidance period
+            self.epoch = now
+            if (self.wmax > self.cwnd):
+                self.k = ((self.wmax - self.cwnd) / CUBIC_C) ** (1.0 / 3.0)
+            else:
+                self.k = 0.0
+                self.wmax = self.cwnd
+            self.reno = self.cwnd
+        t = now - self.epoch
+        target = CUBIC_C * (t - self.k) ** 3 + self.wmax
+        # the window NewReno would have reached, with CUBIC's smaller decrease
+        self.reno += 3.0 * (1.0 - CUBIC_BETA) / (1.0 + CUBIC_BETA) * acked / self.cwnd
+        target = max(target, self.reno)
+        if (target > self.cwnd):
+            self.cwnd += min(target - self.cwnd, self.cwnd / 2.0) * acked / self.cwnd
+        else:
+            self.cwnd += 0.01 * acked / self.cwnd
+
+    def onloss(self, inflight):
+        self.wmax = self.cwnd
+        self.ssthresh = max(self.cwnd * CUBIC_BETA, 2.0)
+        self.cwnd = self.ssthresh
+        self.epoch = None
+
+    def ontimeout(self, inflight):
+        self.wmax = self.cwnd
+        self.ssthresh = max(self.cwnd * CUBIC_BETA, 2.0)
+        self.cwnd = 1.0
+        self.epoch = None
+
+# Vegas, delay based: the smallest RTT seen is the RTT of an empty path. Once
+# per round trip it estimates how many packets sit in queues from how much the
+# RTT has grown, and moves cwnd by one packet to keep that between VEGAS_ALPHA
+# and VEGAS_BETA. Losses are handled like NewReno.
+class Vegas(CongestionControl):
+    name = 'vegas'
 
     def __init__(self):
+        CongestionControl.__init__(self)
+        self.basertt = None
+        self.minrtt = None
+        self.acked = 0
+
+    def onack(self, acked, rtt):
+        if (rtt != None) and (rtt > 0):
+            if (self.basertt == None) or (rtt < self.basertt):
+                self.basertt = rtt
+            if (self.minrtt == None) or (rtt < self.minrtt):
+                self.minrtt = rtt
+        self.acked += acked
+        if (self.acked < self.cwnd) or (self.minrtt == None):
+            if (self.cwnd < self.ssthresh):
+                self.slowstart(acked)
+            return
+        # a window of data was ACKed, one round trip is over
+        queued = self.cwnd * (1.0 - self.basertt / self.minrtt)
+        self.acked = 0
+        self.minrtt = None
+        if (self.cwnd < self.ssthresh):
+            if (queued > VEGAS_GAMMA):
+                self.ssthresh = max(self.cwnd - 1.0, 2.0)
+                self.cwnd = self.ssthresh
+            else:
+                self.slowstart(acked)
+        elif (queued < VEGAS_ALPHA):
+            self.cwnd += 1.0
+        elif (queued > VEGAS_BETA):
+            self.cwnd = max(self.cwnd - 1.0, 2.0)
+
+    def onloss(self, inflight):
+        CongestionControl.onloss(self, inflight)
+        self.acked = 0
+        self.minrtt = None
+
+# the algorithms set_congestion_control can pick, by name. Another algorithm
+# is added with register_congestion_control
+congestion_controls = {'newreno': NewReno, 'cubic': Cubic, 'vegas': Vegas}
+
+def register_congestion_control(name, factory):
+    congestion_controls[name] = factory
+
+# sendmmsg(2) through ctypes, None where there is no ctypes or no sendmmsg
+try:
+    import ctypes
+    import ctypes.util
+
+    # iov_base is a char pointer so a bytes object can be stored into it as is
+    class iovec(ctypes.Structure):
+        _fields_ = [('iov_base', ctypes.c_char_p), ('iov_len', ctypes.c_size_t)]
+
+    # the same with a plain address, for buffers the kernel writes into
+    class bufiovec(ctypes.Structure):
+        _fields_ = [('iov_base', ctypes.c_void_p), ('iov_len', ctypes.c_size_t)]
+
+    class msghdr(ctypes.Structure):
+        _fields_ = [('msg_name', ctypes.c_void_p), ('msg_namelen', ctypes.c_uint32),
+                    ('msg_iov', ctypes.POINTER(iovec)), ('msg_iovlen', ctypes.c_size_t),
+                    ('msg_control', ctypes.c_void_p), ('msg_controllen', ctypes.c_size_t),
+                    ('msg_flags', ctypes.c_int)]
+
+    class mmsghdr(ctypes.Structure):
+        _fields_ = [('msg_hdr', msghdr), ('msg_len', ctypes.c_uint)]
+
+    libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    libc_sendmmsg = libc.sendmmsg
+    libc_sendmmsg.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_uint, ctypes.c_int]
+    libc_sendmmsg.restype = ctypes.c_int
+    libc_recvmmsg = libc.recvmmsg
+    libc_recvmmsg.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_uint, ctypes.c_int, ctypes.c_void_p]
+    libc_recvmmsg.restype = ctypes.c_int
+except (ImportError, OSError, AttributeError):
+    libc_sendmmsg = None
+    libc_recvmmsg = None
+
+# whether the kernel knows the UDP_SEGMENT option, setting it to 0 (off)
+# changes nothing
+def gso_supported(sock):
+    if (not hasattr(sock, 'sendmsg')):
+        return False
+    try:
+        sock.setsockopt(SOL_UDP, UDP_SEGMENT, 0)
+        return True
+    except (ip.error, OSError):
+        return False
+
+# send buffers to address with GSO: each run of datagrams of one size (the
+# last of a run may be shorter) goes in one sendmsg, straight from the list
+# without joining them. Returns the number of system calls.
+def sendgso(sock, buffers, address):
+    calls = 0
+    start = 0
+    count = len(buffers)
+    while (start < count):
+        size = len(buffers[start])
+        end = start + 1
+        total = size
+        while (end < count) and (end - start < GSO_MAX_SEGMENTS) and (len(buffers[end - 1]) == size) \
+              and (len(buffers[end]) <= size) and (total + len(buffers[end]) <= GSO_MAX_BYTES):
+            total += len(buffers[end])
+            end += 1
+        if (end - start == 1):
+            sock.sendto(buffers[start], address)
+        else:
+            sock.sendmsg(buffers[start:end], [(SOL_UDP, UDP_SEGMENT, GSO_SIZE_STRUCT.pack(size))], 0, address)
+        calls += 1
+        start = end
+    return calls
+
+# sendmmsg to one IPv4 address. The message headers for up to size datagrams
+# are built once, a batch only fills in where each datagram is and its length.
+class MmsgSender(object):
+    def __init__(self, size=SEND_BATCH):
+        self.size = size
+        self.iovs = (iovec * size)()
+        self.msgs = (mmsghdr * size)()
+        for i in range(size):
+            self.msgs[i].msg_hdr.msg_iov = ctypes.pointer(self.iovs[i])
+            self.msgs[i].msg_hdr.msg_iovlen = 1
+        self.address = None
+        self.name = None
+
+    # point every message header at the sockaddr_in of address
+    def setaddress(self, address):
+        name = st.pack('=H', ip.AF_INET) + st.pack('!H', address[1]) + ip.inet_aton(ip.gethostbyname(address[0])) + b'\0' * 8
+        self.name = ctypes.create_string_buffer(name, len(name))
+        for i in range(self.size):
+            self.msgs[i].msg_hdr.msg_name = ctypes.cast(self.name, ctypes.c_void_p)
+            self.msgs[i].msg_hdr.msg_namelen = len(name)
+        self.address = address
+
+    # send buffers to address, returns the number of system calls
+    def send(self, sock, buffers, address):
+        if (address != self.address):
+            self.setaddress(address)
+        iovs = self.iovs
+        calls = 0
+        for start in range(0, len(buffers), self.size):
+            chunk = buffers[start:start + self.size]
+            count = len(chunk)
+            for i in range(count):
+                iovs[i].iov_base = chunk[i]
+                iovs[i].iov_len = len(chunk[i])
+            sent = 0
+            while (sent < count):
+                result = libc_sendmmsg(sock.fileno(), ctypes.byref(self.msgs, sent * ctypes.sizeof(mmsghdr)), count - sent, 0)
+                calls += 1
+                if (result < 0):
+                    error = ctypes.get_errno()
+                    if (error == errno.EINTR):
+                        continue
+                    raise ip.error(error, os.strerror(error))
+                sent += result
+        return calls
+
+# recvmmsg into a receive ring. Every message header points at a ring slot
+# of its own, which the receiver holds until a datagram lands in it, so a
+# batch is read where recvpacket would have read each datagram.
+# The arrays are read and written with struct, going through the ctypes
+# fields for every datagram would cost more than the system calls saved.
+class MmsgReceiver(object):
+    def __init__(self, ring, size=RECV_BATCH):
+        self.ring = ring
+        self.size = size
+        self.iovs = (bufiovec * size)()
+        self.msgs = (mmsghdr * size)()
+        self.slots = [None] * size
+        # slot -> its address in memory, good while the ring is at generation
+        self.addresses = {}
+        self.generation = ring.generation
+        # msg_len of every header in one unpack, and iov_base of one iovec
+        skip = mmsghdr.msg_len.offset
+        pad = ctypes.sizeof(mmsghdr) - skip - ctypes.sizeof(ctypes.c_uint)
+        self.lengths = st.Struct('=' + ('%dxI%dx' % (skip, pad)) * size)
+        self.base = st.Struct('P')
+        for i in range(size):
+            self.msgs[i].msg_hdr.msg_iov = ctypes.cast(ctypes.pointer(self.iovs[i]), ctypes.POINTER(iovec))
+            self.msgs[i].msg_hdr.msg_iovlen = 1
+            self.iovs[i].iov_len = ring.slot_size
+            self.setslot(i, ring.acquire())
+
+    # point message header i at a ring slot
+    def setslot(self, i, slot):
+        address = self.addresses.get(slot)
+        if (address == None):
+            (buffer, offset) = self.ring.backing(slot)
+            address = ctypes.addressof((ctypes.c_char * len(buffer)).from_buffer(buffer)) + offset
+            self.addresses[slot] = address
+        self.slots[i] = slot
+        self.base.pack_into(self.iovs, i * ctypes.sizeof(bufiovec), address)
+
+    # read up to size datagrams, returns a list of (slot, length) and the
+    # slots now belong to the caller. With MSG_WAITFORONE this blocks for the
+    # first datagram, with MSG_DONTWAIT it returns [] if there is none.
+    def receive(self, sock, flags):
+        while (True):
+            count = libc_recvmmsg(sock.fileno(), self.msgs, self.size, flags, None)
+            if (count >= 0):
+                break
+            error = ctypes.get_errno()
+            if (error == errno.EINTR):
+                continue
+            if (error == errno.EAGAIN) or (error == errno.EWOULDBLOCK):
+                return []
+            raise ip.error(error, os.strerror(error))
+        slots = self.slots
+        received = list(zip(slots[:count], self.lengths.unpack_from(self.msgs)))
+        ring = self.ring
+        acquire = ring.acquire
+        addresses = self.addresses
+        pack_into = self.base.pack_into
+        iovs = self.iovs
+        stride = ctypes.sizeof(bufiovec)
+        for i in range(count):
+            slot = acquire()
+            if (ring.generation != self.generation):
+                addresses.clear()
+                self.generation = ring.generation
+            if (slot not in addresses):
+                self.setslot(i, slot)
+                continue
+            slots[i] = slot
+            pack_into(iovs, i * stride, addresses[slot])
+        return received
+
+    # give the held slots back to the ring
+    def close(self):
+        for slot in self.slots:
+            self.ring.release(slot)
+        self.slots = []
+
+# path MTUs found by probing, host -> (mtu, time found)
+pmtu_cache = {}
+
+# the MTU of the route the kernel would use to reach host, from a UDP socket
+# connected there (nothing is sent). PMTU_MAX if the kernel does not say.
+def route_mtu(host):
+    probe = ip.socket(ip.AF_INET, ip.SOCK_DGRAM)
+    try:
+        probe.connect((host, 9))
+        return probe.getsockopt(ip.IPPROTO_IP, IP_MTU)
+    except (ip.error, OSError):
+        return PMTU_MAX
+    finally:
+        probe.close()
+
+# the protocol of one connection, what the blocking Socket and the asyncio
+# transport (sock352_asyncio.Connection) share: the RTT estimate and RTO,
+# the retransmission timer, retiring ACKed packets, SACK, go back N and fast
+# retransmit, delayed and piggybacked ACKs and the windows. It does no I/O
+# of its own, the class that drives it supplies
+#   now()                  the clock its timers run on
+#   settimer(when, func)   arm a timer that calls func(timer) at when, the
+#                          timer has a when field
+#   canceltimer(timer)
+#   sendpacket(packet)     send an ACK or a probe
+#   resendpackets(packets) send packets that are resent
+#   giveup(error)          MAX_TIMEOUTS timeouts in a row went unanswered
+#   recvwindow()           the free bytes of our receive buffer
+# and decides what lock is: the Socket shares it with the scheduler thread,
+# on an event loop it is a lock that does nothing. Timer callbacks and the
+# methods that say so take it, the rest are called with it held.
+class ProtocolCore(object):
+    def __init__(self, lock):
+        self.lock = lock
+        self.mySequenceNumber = 0
+        self.otherSequenceNumber = 0
+        # skbufs of every packet sent and not yet ACKed, in sequence order,
+        # and their bytes
+        self.outstanding = collections.deque()
+        self.inflightbytes = 0
+        # smoothed RTT, its variance and the current retransmission timeout,
+        # one retransmission timer runs per connection while data is
+        # outstanding. rtxdue is when it is due (0 if it is not).
+        self.srtt = 0.0
+        self.rttvar = 0.0
+        self.rto = RTO_INITIAL
+        self.backoff = 0
+        self.rtxtimer = None
+        self.rtxdue = 0
+        self.counters = {'packets_sent': 0, 'packets_received': 0,
+                         'retransmits': 0, 'timeouts': 0, 'rtt_samples': 0,
+                         'fast_retransmits': 0, 'dropped': 0,
+                         'window_probes': 0, 'window_updates': 0,
+                         'acks_sent': 0, 'delayed_acks': 0,
+                         'piggybacked_acks': 0}
+        # highest cumulative ACK seen and how many times in a row it repeated
+        self.lastack = 0
+        self.dupacks = 0
+        self.dupackthreshold = DUPACK_THRESHOLD
+        # congestion control, and the sequence number that ends the current
+        # loss recovery, cwnd is cut at most once per window of data
+        self.cc = NewReno()
+        self.recover = 0
+        # skbufs a timeout or fast retransmit found lost, in sequence order,
+        # waiting for cwnd to let them go, how many outstanding are SACKed and
+        # which, as sorted [start, end] ranges
+        self.rtxqueue = collections.deque()
+        self.sackedcount = 0
+        self.sackranges = []
+        # selective repeat: packets that arrived past a hole, by sequence number
+        self.selectiverepeat = False
+        self.reorder = {}
+        # the send window in packets and bytes, 0 for no limit
+        self.windowpackets = DEFAULT_WINDOW
+        self.windowbytes = 0
+        # flow control: our receive buffer, the window we last advertised,
+        # the window the peer advertised (None if unknown, so no limit) and
+        # the zero window probe timer
+        self.flowcontrol = False
+        self.recvbuffer = RECV_BUFFER
+        self.rwndsent = RECV_BUFFER
+        self.peerwindow = None
+        self.probetimer = None
+        self.probeinterval = RTO_INITIAL
+        # delayed ACKs: in order packets not ACKed yet, when their ACK is due
+        # (0 if none is) and the timer that sends it. An ACK that goes out
+        # early only clears delackdue, the timer stays armed and checks it
+        # when it fires. The ACKs to send go on the ackqueue, every one goes
+        # out through the one ackpacket.
+        self.ackevery = ACK_EVERY
+        self.delacktimeout = DELACK_TIMEOUT
+        self.unacked = 0
+        self.delackdue = 0
+        self.delacktimer = None
+        self.ackqueue = collections.deque()
+        self.ackpacket = Packet()
+        self.ackpacket.cntl = ACK
+
+    # feed one RTT measurement into the smoothed RTT and its variance and
+    # recompute the RTO, a fresh sample also ends any backoff
+    def updatertt(self, sample):
+        if (self.counters['rtt_samples'] == 0):
+            self.srtt = sample
+            self.rttvar = sample / 2.0
+        else:
+            self.rttvar = (1.0 - RTT_BETA) * self.rttvar + RTT_BETA * abs(self.srtt - sample)
+            self.srtt = (1.0 - RTT_ALPHA) * self.srtt + RTT_ALPHA * sample
+        self.counters['rtt_samples'] += 1
+        self.resetrto()
+
+    # RTO from the current estimate, without backoff
+    def resetrto(self):
+        self.backoff = 0
+        self.rto = min(max(self.srtt + RTO_K * self.rttvar, RTO_MIN), RTO_MAX)
+
+    # an skbuf that is done with, see Socket.freeskbuf
+    def freeskbuf(self, buf):
+        pass
+
+    # (re)start the retransmission timer one RTO from now, called with the
+    # lock held. Only the deadline moves, a timer armed for earlier is left
+    # alone and rearms itself for the deadline when it goes off, so an ACK
+    # touches the timers only when the RTO shrank.
+    def starttimer(self, now=None):
+        if (now == None):
+            now = self.now()
+        self.rtxdue = now + self.rto
+        if (self.rtxtimer != None) and (self.rtxtimer.when > self.rtxdue):
+            self.canceltimer(self.rtxtimer)
+            self.rtxtimer = None
+        if (self.rtxtimer == None):
+            self.rtxtimer = self.settimer(self.rtxdue, self.retransmit)
+
+    def stoptimer(self):
+        self.rtxdue = 0
+        if (self.rtxtimer != None):
+            self.canceltimer(self.rtxtimer)
+            self.rtxtimer = None
+
+    # the retransmission timer went off: go back N, everything that is
+    # outstanding is lost and resent as cwnd lets it, which after the timeout
+    # is one packet. Double the RTO and rearm. A timer that lost a race with an
+    # ACK is no longer self.rtxtimer and does nothing, one that went off before
+    # the deadline an ACK moved waits for it. After MAX_TIMEOUTS in a row the
+    # connection is given up.
+    def retransmit(self, timer):
+        with self.lock:
+            if (self.rtxtimer is not timer):
+                return
+            self.rtxtimer = None
+            if (self.rtxdue == 0) or (len(self.outstanding) == 0):
+                return
+            if (self.now() < self.rtxdue):
+                self.rtxtimer = self.settimer(self.rtxdue, self.retransmit)
+                return
+            dbg_print(3, "sock352: packet timeout, retransmitting")
+            self.counters['timeouts'] += 1
+            if (self.backoff >= MAX_TIMEOUTS):
+                self.rtxdue = 0
+                self.rtxqueue.clear()
+                self.giveup(ip.timeout("sock352: the other side stopped answering"))
+                return
+            self.cc.ontimeout(len(self.outstanding))
+            self.recover = self.mySequenceNumber
+            self.backoff += 1
+            self.rto = min(self.rto * 2, RTO_MAX)
+            # rearmed even if a resend fails, the timer tries again
+            try:
+                self.queueall()
+                self.releaseresends()
+            finally:
+                self.starttimer()
+
+    # queue every outstanding packet the receiver has not SACKed for a resend,
+    # called with the lock held. Without selective repeat nothing is ever
+    # SACKed. The first packet always is: if it was SACKed, the cumulative
+    # ACK for it was lost and only a resend gets the receiver to ACK it again.
+    def queueall(self):
+        first = self.outstanding[0]
+        self.rtxqueue.clear()
+        for buf in self.outstanding:
+            if (not buf.sacked) or (buf is first):
+                self.rtxqueue.append(buf)
+
+    # selective repeat: queue the holes for a resend, the packets not SACKed
+    # below the highest SACKed one. Without SACK information only the first
+    # packet is known to be missing. Called with the lock held.
+    def queueholes(self):
+        self.rtxqueue.clear()
+        if (len(self.sackranges) == 0):
+            self.rtxqueue.append(self.outstanding[0])
+            return
+        highest = self.sackranges[-1][1]
+        for buf in self.outstanding:
+            if (buf.Packet.seq >= highest):
+                break
+            if (not buf.sacked):
+                self.rtxqueue.append(buf)
+
+    # resend queued packets while fewer than cwnd are in flight, that is
+    # outstanding and neither queued nor SACKed. The first one goes even if
+    # the window is full, a loss always gets one resend. Karn's rule, a
+    # packet that was resent gives no RTT sample. Called with the lock held,
+    # on a loss and on every ACK or SACK that may have opened the window.
+    def releaseresends(self, atleast=1):
+        queue = self.rtxqueue
+        if (len(queue) == 0):
+            return
+        inflight = len(self.outstanding) - len(queue) - self.sackedcount
+        budget = max(self.cc.window() - inflight, atleast)
+        first = self.outstanding[0]
+        packets = []
+        while (budget > 0) and (len(queue) > 0):
+            buf = queue.popleft()
+            # SACKed while it waited
+            if (buf.sacked) and (buf is not first):
+                continue
+            buf.retransmitted = True
+            self.piggyback(buf.Packet)
+            packets.append(buf.Packet)
+            budget -= 1
+        if (len(packets) > 0):
+            self.counters['retransmits'] += len(packets)
+            self.resendpackets(packets)
+
+    # mark the outstanding packets inside the SACK blocks of an ACK, they are
+    # not retransmitted again. The receiver repeats its blocks on every ACK,
+    # so each is laid over the ranges already marked and only what it newly
+    # covers is marked. Called with the lock held.
+    def marksacked(self, blocks):
+        outstanding = self.outstanding
+        if (len(outstanding) == 0):
+            return
+        first = outstanding[0].Packet.seq
+        last = first + len(outstanding) - 1
+        ranges = self.sackranges
+        for (start, end) in blocks:
+            start = max(start, first)
+            end = min(end, last)
+            if (start > end):
+                continue
+            # the ranges this block overlaps or touches are i to j - 1, they
+            # become one. Between them are the gaps it newly covers.
+            i = 0
+            while (i < len(ranges)) and (ranges[i][1] < start - 1):
+                i += 1
+            merged = [start, end]
+            seq = start
+            j = i
+            while (j < len(ranges)) and (ranges[j][0] <= end + 1):
+                (low, high) = ranges[j]
+                self.marksackrange(seq, min(low - 1, end), first)
+                seq = max(seq, high + 1)
+                merged = [min(merged[0], low), max(merged[1], high)]
+                j += 1
+            self.marksackrange(seq, end, first)
+            ranges[i:j] = [merged]
+
+    def marksackrange(self, start, end, first):
+        outstanding = self.outstanding
+        for seq in range(start, end + 1):
+            buf = outstanding[seq - first]
+            if (buf.Packet.seq == seq) and (not buf.sacked):
+                buf.sacked = True
+                self.sackedcount += 1
+
+    # retransmit after this many duplicate ACKs, 0 turns fast retransmit off
+    def set_dupack_threshold(self, count):
+        self.dupackthreshold = count
+
+    # enough duplicate ACKs came in to assume the packet after lastack was
+    # lost, so resend without waiting for the timer. A go back N receiver threw
+    # away everything after the hole, so like a timeout this resends it all.
+    # A selective repeat receiver kept it and only the holes are resent. Both
+    # go out as the cut cwnd lets them. Called with the lock held.
+    def fastretransmit(self):
+        if (len(self.outstanding) == 0):
+            return
+        dbg_print(3, "sock352: duplicate ACKs, fast retransmit")
+        self.counters['fast_retransmits'] += 1
+        # the loss is in new data, not in the window the last cut was for
+        if (self.lastack >= self.recover):
+            self.cc.onloss(len(self.outstanding))
+            self.recover = self.mySequenceNumber
+        if (self.selectiverepeat):
+            self.queueholes()
+        else:
+            self.queueall()
+        self.releaseresends()
+        self.starttimer()
+
+    # an ACK past lastack retires packets, the same ACK again on a packet
+    # that carries nothing new is a duplicate. Takes the lock.
+    def handleack(self, packet):
+        ack = packet.ack
+        with self.lock:
+            # SACK blocks are marked first, so a fast retransmit knows the holes
+            if (self.selectiverepeat) and (packet.options != None) and (OPT_SACK in packet.options):
+                self.marksacked(unpack_sack(packet.options[OPT_SACK]))
+                self.releaseresends(0)
+            if (ack > self.lastack):
+                self.lastack = ack
+                self.dupacks = 0
+                self.retire(ack)
+            elif (ack == self.lastack) and ((packet.cntl & (DATA | FIN)) == 0):
+                self.dupacks += 1
+                if (self.dupacks == self.dupackthreshold):
+                    self.fastretransmit()
+
+    # free the packets a cumulative ACK covers. The outstanding and resend
+    # queues are kept in sequence order, so retiring only touches the packets
+    # that are freed and never scans the rest of the window.
+    # The newest packet freed that was never retransmitted gives an RTT sample.
+    # Called with the lock held.
+    # The trade-off: every ACK also pays a fixed cost for the RTT estimate,
+    # congestion control and the timer, about 2us here. The old list scan
+    # did none of that, and for small windows the scan was cheaper. A
+    # 16-packet window retires at about 0.25x the old rate, 256 packets at
+    # about 1x, and 4096 packets at about 14x. Without a loss, the work on
+    # the resend queue and the SACK ranges is skipped, and the clock is read
+    # once per ACK.
+    def retire(self, ack):
+        outstanding = self.outstanding
+        freed = 0
+        sample = None
+        now = self.now()
+        while (len(outstanding) > 0) and (outstanding[0].Packet.seq <= ack):
+            buf = outstanding.popleft()
+            self.inflightbytes -= buf.Packet.size
+            if (not buf.retransmitted):
+                sample = now - buf.time_sent
+            if (buf.sacked):
+                self.sackedcount -= 1
+            self.freeskbuf(buf)
+            freed += 1
+        if (freed == 0):
+            return
+        rtxqueue = self.rtxqueue
+        while (len(rtxqueue) > 0) and (rtxqueue[0].Packet.seq <= ack):
+            rtxqueue.popleft()
+        ranges = self.sackranges
+        while (len(ranges) > 0) and (ranges[0][0] <= ack):
+            if (ranges[0][1] > ack):
+                ranges[0][0] = ack + 1
+                break
+            del ranges[0]
+        self.cc.onack(freed, sample)
+        if (sample != None):
+            self.updatertt(sample)
+        elif (self.backoff > 0):
+            # only retransmitted packets were ACKed, which gives no sample
+            # (Karn), but the path works again so the backoff is dropped
+            self.resetrto()
+        # the resend queue only fills up after a loss
+        if (len(rtxqueue) > 0):
+            self.releaseresends(0)
+        # new data was ACKed, time the oldest packet still out from now.
+        # With nothing out the timer is left to go off and do nothing.
+        if (len(outstanding) > 0):
+            self.starttimer(now)
+        else:
+            self.rtxdue = 0
+
+    # send a standalone ACK for every sequence number in the ackqueue
+    # with selective repeat they carry SACK blocks for the reorder buffer, and
+    # with flow control our receive window. Takes the lock.
+    def sendacks(self):
+        if (len(self.ackqueue) == 0):
+            return
+        with self.lock:
+            options = None
+            if (len(self.reorder) > 0):
+                options = {OPT_SACK: pack_sack(self.sackblocks())}
+            if (self.flowcontrol):
+                if (options == None):
+                    options = {}
+                self.rwndsent = self.recvwindow()
+                options[OPT_RWND] = WINDOW_STRUCT.pack(self.rwndsent)
+            packet = self.ackpacket
+            packet.options = options
+            while (len(self.ackqueue) > 0):
+                packet.ack = self.ackqueue.popleft()
+                # an ACK of everything received so far covers the delayed ones
+                if (packet.ack >= self.otherSequenceNumber):
+                    self.unacked = 0
+                    self.delackdue = 0
+                self.sendpacket(packet)
+                self.counters['acks_sent'] += 1
+
+    # ACK every count in order packets with one cumulative ACK, or timeout
+    # seconds after the first unACKed one. count=1 ACKs every packet at once.
+    # Out of order and duplicate packets, FINs, probes and packets that fill
+    # a hole are always ACKed at once.
+    def set_delayed_ack(self, count=ACK_EVERY, timeout=DELACK_TIMEOUT):
+        self.ackevery = count
+        self.delacktimeout = timeout
+
+    # count an in order packet towards the next delayed ACK, start the timer
+    # for it or queue the ACK if it is due
+    def delayack(self):
+        self.unacked += 1
+        if (self.unacked >= self.ackevery) or (self.delacktimeout <= 0):
+            self.ackqueue.append(self.otherSequenceNumber)
+            return
+        with self.lock:
+            if (self.delackdue == 0):
+                self.delackdue = self.now() + self.delacktimeout
+            if (self.delacktimer == None):
+                self.delacktimer = self.settimer(self.delackdue, self.delack)
+
+    # the delayed ACK timer went off, ACK what has arrived so far. If an ACK
+    # went out since it was armed, wait until the ACK now pending is due.
+    def delack(self, timer):
+        with self.lock:
+            if (self.delacktimer is not timer):
+                return
+            self.delacktimer = None
+            if (self.delackdue == 0):
+                return
+            if (self.now() < self.delackdue):
+                self.delacktimer = self.settimer(self.delackdue, self.delack)
+                return
+            self.delackdue = 0
+            self.counters['delayed_acks'] += 1
+        self.ackqueue.append(self.otherSequenceNumber)
+        self.sendacks()
+
+    # a DATA or FIN packet carries the cumulative ACK and our window, so a
+    # delayed ACK that is still waiting is not needed. Called with the lock
+    # held, also on a resend so the packet never goes out with a stale ACK.
+    def piggyback(self, packet):
+        packet.cntl |= ACK
+        packet.ack = self.otherSequenceNumber
+        if (self.flowcontrol):
+            self.rwndsent = self.recvwindow()
+            packet.options = {OPT_RWND: WINDOW_STRUCT.pack(self.rwndsent)}
+        if (self.unacked > 0):
+            self.counters['piggybacked_acks'] += 1
+            self.unacked = 0
+            self.delackdue = 0
+
+    # called with the lock held
+    def stopdelack(self):
+        self.delackdue = 0
+        if (self.delacktimer != None):
+            self.canceltimer(self.delacktimer)
+            self.delacktimer = None
+
+    # the runs of sequence numbers in the reorder buffer, lowest first since
+    # those border the holes the sender has to fill
+    def sackblocks(self):
+        blocks = []
+        for seq in sorted(self.reorder):
+            if (len(blocks) > 0) and (blocks[-1][1] == seq - 1):
+                blocks[-1][1] = seq
+            elif (len(blocks) == MAX_SACK_BLOCKS):
+                break
+            else:
+                blocks.append([seq, seq])
+        return blocks
+
+    # True if sending size more bytes would go past the window, the
+    # congestion window or the receive window of the peer. One packet may
+    # always be in flight, even if it is larger than a byte window, unless
+    # the peer has no room at all.
+    def windowfull(self, size):
+        inflight = len(self.outstanding)
+        if (inflight == 0):
+            if (self.peerwindow == 0):
+                with self.lock:
+                    self.startprobe()
+                return True
+            return False
+        if (inflight >= self.cc.window()):
+            return True
+        if (self.windowpackets > 0) and (inflight >= self.windowpackets):
+            return True
+        if (self.windowbytes > 0) and (self.inflightbytes + size > self.windowbytes):
+            return True
+        if (self.peerwindow != None) and (self.inflightbytes + size > self.peerwindow):
+            return True
+        return False
+
+    # take the receive window a packet advertises. An ACK older than the last
+    # one may carry an older window and is ignored.
+    def handlewindow(self, packet):
+        if (not self.flowcontrol) or (packet.options == None) or (OPT_RWND not in packet.options):
+            return
+        if (packet.cntl & ACK) and (packet.ack < self.lastack):
+            return
+        value = packet.options[OPT_RWND]
+        if (len(value) < WINDOW_STRUCT.size):
+            return
+        self.peerwindow = WINDOW_STRUCT.unpack_from(value)[0]
+        if (self.peerwindow > 0) and (self.probetimer != None):
+            with self.lock:
+                self.stopprobe()
+
+    # the peer advertised a zero window and nothing is in flight, so no ACK
+    # will come to open it. Ask for the window with a probe every RTO,
+    # backing off, until it opens. Called with the lock held.
+    def startprobe(self):
+        if (self.probetimer == None):
+            self.probeinterval = self.rto
+            self.probetimer = self.settimer(self.now() + self.probeinterval, self.probe)
+
+    def stopprobe(self):
+        if (self.probetimer != None):
+            self.canceltimer(self.probetimer)
+            self.probetimer = None
+
+    def probe(self, timer):
+        with self.lock:
+            if (self.probetimer is not timer):
+                return
+            self.probetimer = None
+            if (self.peerwindow != 0):
+                return
+            packet = Packet()
+            packet.cntl = PROBE
+            packet.seq = self.mySequenceNumber
+            # the next probe is armed first, so a failed send does not end them
+            self.probeinterval = min(self.probeinterval * 2, RTO_MAX)
+            self.probetimer = self.settimer(self.now() + self.probeinterval, self.probe)
+            self.sendpacket(packet)
+            self.counters['window_probes'] += 1
+
+class Socket(ProtocolCore):
+
+    # udpsocket is the UDP socket to use, a new one if None. The connections
+    # of a listening socket all use the listener's
+    def __init__(self, udpsocket=None):
         # ... your code here ...
-        self.mysocket = ip.socket(ip.AF_INET,ip.SOCK_DGRAM)
+        # the protocol state (see ProtocolCore), the lock guards it against
+        # the scheduler thread
+        ProtocolCore.__init__(self, threading.Lock())
+        if (udpsocket == None):
+            udpsocket = ip.socket(ip.AF_INET,ip.SOCK_DGRAM)
+        self.mysocket = udpsocket
         self.port = 0
         self.childsocket = 0
-        self.mySequenceNumber = 0
         self.OtherSequenceNumber = 0
         self.RTT = 0
-        self.transmitqueue = []
-        self.ackqueue = []
+        # the packets of the handshake
+        self.transmitqueue = collections.deque()
+        self.counters.update({'paced': 0, 'reassembled': 0,
+                              'pmtu_probes': 0, 'send_calls': 0,
+                              'recv_calls': 0, 'coalesced_acks': 0,
+                              'recv_copies': 0,
+                              'accepted': 0, 'listen_drops': 0,
+                              'handshake_timeouts': 0})
+        self.dropprob = 0.0
+        self.random = random.Random()
         self.lastpacketrecived = 0
         self.LPR = 0
         self.clientaddress = 0;
         self.serveraddress = 0
+        self.recvring = None
+        self.heldslot = None
+        self.packetpool = None
+        self.skbufpool = None
+        self.recvqueue = collections.deque()
+        self.remoteclosed = False
+        # the pacer: skbufs of packets waiting for a token, the tokens and when
+        # they were last topped up, and the timer that sends the next packet
+        self.pacing = False
+        self.pacequeue = collections.deque()
+        self.tokens = PACING_BURST
+        self.lastpace = 0.0
+        self.pacetimer = None
+        # flow control: the bytes waiting in recvqueue, they count against
+        # the receive buffer
+        self.recvqueuebytes = 0
+        # segmentation: the largest payload of one packet, whether the other
+        # side reassembles segmented messages (always offered) and the
+        # message being put back together, if any
+        self.mss = DEFAULT_MSS
+        self.segmentation = True
+        self.partial = None
+        # path MTU discovery: whether to probe, whether the other side answers
+        # probes (always offered), the path MTU found and the largest probe
+        # answered so far
+        self.pmtudiscovery = PMTU_SUPPORTED
+        self.pmtuecho = True
+        self.pmtu = None
+        self.pmtuacked = 0
+        # batched transmit: how batches are sent ('gso', 'sendmmsg' or
+        # 'sendto', None when batching is off) and the packed packets of
+        # the batch being collected
+        self.batchmode = None
+        self.sendbatch = []
+        self.mmsgsender = None
+        # batched receive: 'recvmmsg' or None when it is off, and the
+        # receiver holding the ring slots for the next batch
+        self.batchrecv = None
+        self.mmsgreceiver = None
+        # listening: the connections by peer address and the ones that
+        # finished the handshake and wait for accept(), None unless listen()
+        # was called. A connection of a listener points back at it, shares
+        # its UDP socket and receive ring and is handshaking until the
+        # client ACKs the SYN ACK. closedcounters sums the counters of the
+        # connections that are gone.
+        self.connections = None
+        self.closedcounters = None
+        self.acceptqueue = None
+        self.backlog = 0
+        self.listener = None
+        self.handshaking = False
+        self.synacktime = 0.0
+        # half-open connections of a listener count against the backlog.
+        # A half-open one resends its SYN ACK on synacktimer, syntries times
+        # so far
+        self.halfopen = 0
+        self.synacktimer = None
+        self.syntries = 0
+        # the address the last datagram read came from
+        self.fromaddress = None
+        # timeouts: how long a call may wait, None for as long as it takes
+        # and 0.0 for non-blocking. connected is set once the handshake is
+        # done.
+        self.timeout = None
+        self.connected = False
+        # an error the scheduler thread ran into for this socket, raised by
+        # the next call of the application (see seterror)
+        self.error = None
+        # readiness (see fileno): the socketpair whose read end is readable
+        # while recvfrom would not block and whether it is signalled now.
+        # Once it exists the scheduler thread reads the UDP socket
+        # (serviced).
+        self.wakeup = None
+        self.signalled = False
+        self.serviced = False
+        # threads: every call of the application holds iocond, so one thread
+        # can send while another receives. It is let go while a thread waits
+        # for packets (reading), the others wait on it until progress
+        # changes. The connections of a listener share its iocond.
+        self.iocond = threading.Condition(threading.Lock())
+        self.progress = 0
+        self.reading = False
+        # what a read with a timeout waits on, the UDP socket itself stays
+        # blocking (see readwithin)
+        self.poller = None
+        # the engine (set_engine): segments sendto queued that the window
+        # had no room for yet, and their bytes
+        self.engine = False
+        self.sendbuffer = SEND_BUFFER
+        self.sendqueue = collections.deque()
+        self.sendqueuebytes = 0
 
         pass 
 
@@ -211,9 +1737,10 @@ class Socket:
     #
     # you do not need to implement the body of this method,
     # but it must be in the library,
+    # incoming packets are dropped with this probability (0.0 - 1.0) once the
+    # connection is established, to test the recovery code
     def set_drop_prob(self, probability):
-
-        pass 
+        self.dropprob = probability
 
     # Set the seed for the random number generator to get
     # a consistent set of random numbers
@@ -222,8 +1749,472 @@ class Socket:
     # but it must be in the library.
     def set_random_seed(self, seed):
         self.random_seed = seed 
+        self.random.seed(seed)
         
 
+    # recycle Packet and skbuf objects through a freelist of up to size objects
+    # each, 0 turns the pool off (the default). On CPython a __slots__ object
+    # is cheaper to build than to recycle (sock352_bench.py pool), the pool
+    # pays off where allocation or garbage collection costs more.
+    def set_packet_pool(self, size=PACKET_POOL_SIZE):
+        if (size > 0):
+            self.packetpool = ObjectPool(Packet, size)
+            self.skbufpool = ObjectPool(skbuf, size)
+        else:
+            self.packetpool = None
+            self.skbufpool = None
+
+    # how many objects each pool holds and how often it could recycle one
+    def get_pool_stats(self):
+        if (self.packetpool == None):
+            return None
+        return {'packets': self.packetpool.stats(), 'skbufs': self.skbufpool.stats()}
+
+    def newpacket(self):
+        if (self.packetpool == None):
+            return Packet()
+        return self.packetpool.get()
+
+    def freepacket(self, packet):
+        if (self.packetpool != None):
+            self.packetpool.put(packet)
+
+    def newskbuf(self, packet, time_sent):
+        if (self.skbufpool == None):
+            return skbuf(packet, time_sent)
+        buf = self.skbufpool.get()
+        buf.Packet = packet
+        buf.time_sent = time_sent
+        return buf
+
+    # an ACKed packet is done with, give both it and its skbuf back
+    def freeskbuf(self, buf):
+        if (self.skbufpool != None):
+            self.packetpool.put(buf.Packet)
+            self.skbufpool.put(buf)
+
+    # ask for selective repeat, must be called before connect/accept. It is
+    # only used if the other side supports it too, which is settled in the
+    # SYN exchange. Out of order packets are then kept and reported back in
+    # SACK blocks, and only the missing packets are retransmitted.
+    def set_selective_repeat(self, enable=True):
+        self.selectiverepeat = enable
+
+    # pick the congestion control algorithm by name, one of the keys of
+    # congestion_controls ('newreno' by default, 'cubic', 'vegas')
+    def set_congestion_control(self, name):
+        if (name not in congestion_controls):
+            raise ValueError("sock352: unknown congestion control %s" % name)
+        with self.lock:
+            self.cc = congestion_controls[name]()
+
+    # space new packets out at the pacing rate instead of sending them as soon
+    # as the window allows. Retransmissions are not paced.
+    def set_pacing(self, enable=True):
+        self.pacing = enable
+
+    # advertise the free space in our receive buffer so the sender never
+    # has more in flight than we can hold. It is only used if the other side
+    # supports it too, must be called before connect/accept.
+    # With it on, data the application does not read stops the sender, so
+    # two sides that both only send and never read will wait on each other.
+    def set_flow_control(self, enable=True):
+        self.flowcontrol = enable
+        if (enable):
+            self.set_recv_buffer(self.recvbuffer)
+
+    # how many bytes of received data to hold for the application. The
+    # kernel buffer has to hold a whole window as well, and it charges a
+    # datagram about twice its size, so it gets twice as much
+    def set_recv_buffer(self, nbytes):
+        self.recvbuffer = nbytes
+        self.rwndsent = nbytes
+        self.mysocket.setsockopt(ip.SOL_SOCKET, ip.SO_RCVBUF, 2 * nbytes)
+        if (self.pmtu != None) and (self.pmtudiscovery):
+            self.setpmtu(self.pmtu)
+
+    # the largest payload sent in one packet. sendto splits a longer message
+    # into segments of this size if the other side can reassemble them,
+    # sendall cuts a buffer into messages of this size. An mss set here is
+    # kept, path MTU discovery is turned off
+    def set_mss(self, nbytes):
+        if (nbytes < 1) or (nbytes > MAX_SIZE):
+            raise ValueError("sock352: mss must be between 1 and %d bytes" % MAX_SIZE)
+        self.mss = nbytes
+        self.pmtudiscovery = False
+
+    # collect new packets and send them many per system call: a batch goes
+    # out when it is full, before sendto waits for the window and when
+    # sendto/sendall return. Retransmissions after a timeout are batched
+    # too. Uses GSO where the kernel has it, else sendmmsg, else sendto per
+    # packet. Paced packets are sent one at a time all the same.
+    def set_batched_send(self, enable=True):
+        self.flushbatch()
+        if (not enable):
+            self.batchmode = None
+        elif (gso_supported(self.mysocket)):
+            self.batchmode = 'gso'
+        elif (libc_sendmmsg != None):
+            self.batchmode = 'sendmmsg'
+        else:
+            self.batchmode = 'sendto'
+
+    # read every datagram that is waiting with one recvmmsg system call and
+    # process them as a batch: an ACK is only retired if no higher one
+    # follows it in the batch, and the ACKs the batch produced go out after
+    # all of it is processed. For bulk transfers, a lone packet costs a bit
+    # more this way. Where libc has no recvmmsg this stays one datagram per
+    # call.
+    def set_batched_recv(self, enable=True):
+        if (self.mmsgreceiver != None):
+            self.mmsgreceiver.close()
+            self.mmsgreceiver = None
+        if (enable) and (libc_recvmmsg != None):
+            self.batchrecv = 'recvmmsg'
+            if (self.mysocket.getsockopt(ip.SOL_SOCKET, ip.SO_RCVBUF) < RECV_BATCH_BUFFER):
+                self.mysocket.setsockopt(ip.SOL_SOCKET, ip.SO_RCVBUF, RECV_BATCH_BUFFER)
+        else:
+            self.batchrecv = None
+
+    # probe the path MTU after connect/accept and size the mss to it, on by
+    # default where the kernel lets us set the DF bit (Linux). Only done if
+    # the other side answers probes, the result is cached per host.
+    def set_pmtu_discovery(self, enable=True):
+        self.pmtudiscovery = enable and PMTU_SUPPORTED
+
+    # like a Python socket: recvfrom, sendto, sendall, accept and connect
+    # wait at most timeout seconds and then raise socket.timeout, None waits
+    # for as long as it takes. With 0.0 (setblocking(False)) the socket is
+    # non-blocking: what cannot go on at once raises socket.error EAGAIN.
+    # A message longer than the mss that got its first segment out is sent
+    # whole even so, and connect waits for the handshake like with no
+    # timeout. close() waits for the other side's FIN at most the timeout,
+    # but at least a few RTOs, and then gives up on it.
+    def settimeout(self, value):
+        if (value != None):
+            value = float(value)
+            if (value < 0):
+                raise ValueError("sock352: timeout must be None or >= 0")
+        self.timeout = value
+
+    def gettimeout(self):
+        return self.timeout
+
+    def setblocking(self, flag):
+        if (flag):
+            self.settimeout(None)
+        else:
+            self.settimeout(0.0)
+
+    # a file descriptor for select/poll/epoll that is readable exactly when
+    # recvfrom would not block: a message is waiting or the other side has
+    # closed. For a listener, when accept() would not block. From the first
+    # call on the scheduler thread reads the UDP socket whenever something
+    # arrives, so data shows up while the application sits in select.
+    def fileno(self):
+        with self.iocond:
+            if (self.wakeup == None):
+                self.wakeup = ip.socketpair()
+                self.wakeup[0].setblocking(False)
+                self.wakeup[1].setblocking(False)
+                self.signalled = False
+                self.updatewakeup()
+                if (self.connected) or (self.connections != None) or (self.listener != None):
+                    self.startservice()
+            return self.wakeup[0].fileno()
+
+    # hand the protocol to the scheduler thread once connected: it reads the
+    # UDP socket as packets arrive, ACKs them, queues the data for recvfrom
+    # and sends what sendto queued as the window opens. sendto only waits
+    # while sendbuffer bytes are queued, recvfrom only while nothing is,
+    # so a sender that never reads still gets its ACKs. Turns on flow
+    # control, which bounds what is queued on the receiving side if the
+    # other side has it too. Must be called before connect/accept/listen.
+    def set_engine(self, enable=True, sendbuffer=SEND_BUFFER):
+        self.engine = enable
+        self.sendbuffer = sendbuffer
+        if (enable):
+            self.set_flow_control()
+
+    # whether recvfrom (accept on a listener) would return without waiting
+    def readable(self):
+        if (self.connections != None):
+            return (len(self.acceptqueue) > 0)
+        return (len(self.recvqueue) > 0) or (self.remoteclosed)
+
+    # make the fileno readable if and only if the socket is
+    def updatewakeup(self):
+        if (self.wakeup == None):
+            return
+        ready = self.readable()
+        if (ready != self.signalled):
+            self.signalled = ready
+            if (ready):
+                self.wakeup[1].send(b'\0')
+            else:
+                self.wakeup[0].recv(1)
+
+    # have the scheduler thread read the UDP socket from now on. For a
+    # connection of a listener it is the listener that gets serviced.
+    def startservice(self):
+        owner = self
+        if (self.listener != None):
+            owner = self.listener
+        if (not owner.serviced):
+            owner.serviced = True
+            scheduler.watch(owner)
+
+    def stopservice(self):
+        if (self.serviced):
+            self.serviced = False
+            scheduler.unwatch(self)
+
+    # called by the scheduler thread when the UDP socket is readable: process
+    # what has arrived, which wakes up the application if it waits for it
+    def service(self):
+        with self.iocond:
+            if (not self.serviced):
+                return
+            step = self.pump
+            if (self.connections != None):
+                step = self.demux
+            count = 0
+            while (count < SERVICE_BATCH) and step(0.0):
+                count += 1
+
+    # a serviced socket does not read the UDP socket and block, the
+    # scheduler thread would be stuck behind it. It takes what is there
+    # and then waits for the scheduler thread to process more.
+    def waitservice(self, timeout, step):
+        if (step(0.0)):
+            return True
+        return self.waitprogress(timeout)
+
+    # wait at most timeout for another thread to process packets, returns
+    # whether it did. Called with the iocond held.
+    def waitprogress(self, timeout):
+        if (timeout == 0.0):
+            return False
+        progress = self.progress
+        self.iocond.wait(timeout)
+        return (self.progress != progress)
+
+    # read with the iocond released, so that other threads can send and
+    # take what has arrived while this one waits for packets. One thread
+    # reads at a time, the others wait for it in waitprogress and get
+    # woken up when it is done. None if nothing came in time.
+    def readreleased(self, timeout, read):
+        self.reading = True
+        self.iocond.release()
+        try:
+            return self.readwithin(timeout, read)
+        finally:
+            self.iocond.acquire()
+            self.reading = False
+            self.iocond.notify_all()
+
+    # when a call started now with the timeout runs out, None for never
+    def deadline(self):
+        if (self.timeout == None):
+            return None
+        return time.time() + self.timeout
+
+    # process packets until ready() is true or the deadline has passed,
+    # returns whether ready() is true
+    def waitfor(self, ready, deadline):
+        while (not ready()):
+            self.raiseerror()
+            if (deadline == None):
+                self.pump()
+                continue
+            left = deadline - time.time()
+            if (left > 0):
+                self.pump(left)
+                continue
+            # out of time, one last look at what has arrived
+            while (self.pump(0.0)):
+                if (ready()):
+                    return True
+            return False
+        return True
+
+    # keep an error of the scheduler thread, a failed send in a timer say,
+    # for the application. Only the first one is kept, the next call raises
+    # it (see raiseerror) and a thread waiting for progress is woken for it.
+    def seterror(self, error):
+        with self.iocond:
+            if (self.error == None):
+                self.error = error
+            self.iocond.notify_all()
+
+    # raise the error seterror kept, once, like SO_ERROR
+    def raiseerror(self):
+        error = self.error
+        if (error != None):
+            self.error = None
+            raise error
+
+    # the error of a call that ran out of time, EAGAIN when non-blocking
+    def timedout(self):
+        if (self.timeout == 0.0):
+            return ip.error(errno.EAGAIN, "sock352: operation would block")
+        return ip.timeout("timed out")
+
+    # read with a timeout (0.0 to not block), None if nothing came. The UDP
+    # socket is shared with the threads that send on it, so its timeout is
+    # left alone: a timeout set here would make their sendto fail too. The
+    # wait is a poll, and the read after it does not block. With 0.0 the
+    # read alone tells, without the poll
+    def readwithin(self, timeout, read):
+        if (timeout == None):
+            return read(True)
+        if (timeout > 0):
+            if (self.poller == None):
+                self.poller = Poller()
+                self.poller.register(self.mysocket.fileno())
+            if (len(self.poller.wait(timeout)) == 0):
+                return None
+        try:
+            return read(False)
+        except ip.error as e:
+            if (e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK)):
+                return None
+            raise
+
+    # the feature bits this side offers in the SYN exchange
+    def features(self):
+        bits = 0
+        if (self.selectiverepeat):
+            bits |= FEATURE_SACK
+        if (self.flowcontrol):
+            bits |= FEATURE_RWND
+        if (self.segmentation):
+            bits |= FEATURE_SEGMENT
+        if (self.pmtuecho):
+            bits |= FEATURE_PMTU
+        return bits
+
+    # turn on what both sides agreed to in the SYN exchange
+    def setfeatures(self, bits):
+        self.selectiverepeat = ((bits & FEATURE_SACK) != 0)
+        self.flowcontrol = ((bits & FEATURE_RWND) != 0)
+        self.segmentation = ((bits & FEATURE_SEGMENT) != 0)
+        self.pmtuecho = ((bits & FEATURE_PMTU) != 0)
+
+    # the options of a SYN offer or SYN ACK accept of features, with our
+    # receive window if flow control is part of it
+    def synoptions(self, kind):
+        options = {kind: FEATURE_STRUCT.pack(self.features())}
+        if (self.flowcontrol):
+            options[OPT_RWND] = WINDOW_STRUCT.pack(self.recvwindow())
+        return options
+
+    # find the path MTU to the other side and set the mss from it. A path
+    # that answers no probe at all is left at the default mss and not cached,
+    # the other side may just not have been reading yet
+    def discoverpmtu(self):
+        if (not self.pmtudiscovery) or (not self.pmtuecho):
+            return
+        host = self.peeraddress()[0]
+        cached = pmtu_cache.get(host)
+        if (cached != None) and (time.time() - cached[1] < PMTU_CACHE_TIME):
+            self.setpmtu(cached[0])
+            return
+        try:
+            saved = self.mysocket.getsockopt(ip.IPPROTO_IP, IP_MTU_DISCOVER)
+            self.mysocket.setsockopt(ip.IPPROTO_IP, IP_MTU_DISCOVER, IP_PMTUDISC_PROBE)
+        except (ip.error, OSError):
+            return
+        try:
+            self.pmtuacked = 0
+            high = max(min(route_mtu(host), PMTU_MAX), PMTU_MIN)
+            if (self.pmtuprobe(high)):
+                low = high
+            else:
+                # low is known to get through, high is not. Most paths are
+                # Ethernet, which splits the search in two
+                low = PMTU_MIN
+                if (high > DEFAULT_MTU):
+                    if (self.pmtuprobe(DEFAULT_MTU)):
+                        low = DEFAULT_MTU
+                    else:
+                        high = DEFAULT_MTU
+                while (high - low > PMTU_PRECISION):
+                    middle = (low + high) // 2
+                    if (self.pmtuprobe(middle)):
+                        low = middle
+                    else:
+                        high = middle
+            if (self.pmtuacked == 0):
+                return
+            pmtu_cache[host] = (low, time.time())
+            self.setpmtu(low)
+        finally:
+            self.mysocket.setsockopt(ip.IPPROTO_IP, IP_MTU_DISCOVER, saved)
+
+    def setpmtu(self, mtu):
+        self.pmtu = mtu
+        mss = min(mtu - DATA_OVERHEAD, PMTU_MSS_MAX)
+        if (self.flowcontrol):
+            mss = min(mss, max(self.recvbuffer // PMTU_BUFFER_SHARE, DEFAULT_MSS))
+        self.mss = mss
+        # the kernel charges a datagram about twice its size
+        wanted = 2 * max(self.windowpackets, DEFAULT_WINDOW) * (mss + DATA_OVERHEAD)
+        for option in (ip.SO_RCVBUF, ip.SO_SNDBUF):
+            if (self.mysocket.getsockopt(ip.SOL_SOCKET, option) < wanted):
+                self.mysocket.setsockopt(ip.SOL_SOCKET, option, wanted)
+
+    # send a probe of size bytes (IP datagram) and wait for its echo,
+    # PMTU_PROBE_TRIES times. False if it is too big or never answered.
+    def pmtuprobe(self, size):
+        packet = Packet()
+        packet.cntl = PROBE
+        packet.seq = self.mySequenceNumber
+        packet.options = {OPT_PMTU: PMTU_STRUCT.pack(size)}
+        packet.data = b'\0' * (size - PMTU_PROBE_OVERHEAD)
+        packet.size = len(packet.data)
+        buffer = packet.pack()
+        for i in range(PMTU_PROBE_TRIES):
+            try:
+                self.mysocket.sendto(buffer, self.peeraddress())
+            except (ip.error, OSError) as e:
+                # bigger than the MTU of our own interface
+                if (e.errno == errno.EMSGSIZE):
+                    return False
+                raise
+            self.counters['pmtu_probes'] += 1
+            deadline = time.time() + min(max(4 * self.srtt, PMTU_PROBE_WAIT), self.rto)
+            while (self.pmtuacked < size):
+                left = deadline - time.time()
+                if (left <= 0):
+                    break
+                self.pump(left)
+            if (self.pmtuacked >= size):
+                return True
+        return False
+
+    # a path MTU probe is answered with its size, an answer is taken. Neither
+    # carries anything else.
+    def handlepmtu(self, packet):
+        value = packet.options[OPT_PMTU]
+        if (len(value) < PMTU_STRUCT.size):
+            return
+        size = PMTU_STRUCT.unpack_from(value)[0]
+        if (packet.cntl & PROBE):
+            answer = Packet()
+            answer.cntl = ACK
+            answer.ack = self.otherSequenceNumber
+            answer.options = {OPT_PMTU: PMTU_STRUCT.pack(size)}
+            self.mysocket.sendto(answer.pack(), self.peeraddress())
+        else:
+            self.pmtuacked = max(self.pmtuacked, size)
+
+    # the address of the other side of the connection
+    def peeraddress(self):
+        if (self.serveraddress == 0):
+            return self.clientaddress
+        return self.serveraddress
+
     # bind the address to a port
     # You must implement this method
     #
@@ -231,6 +2222,13 @@ class Socket:
         self.mysocket.bind((address))
         pass 
 
+    # let listeners in other processes bind the same port (SO_REUSEPORT),
+    # see Supervisor. Must be called before bind().
+    def set_reuse_port(self, enable=True):
+        if (not REUSEPORT_SUPPORTED):
+            raise ValueError("sock352: SO_REUSEPORT needs Linux")
+        self.mysocket.setsockopt(ip.SOL_SOCKET, SO_REUSEPORT, int(enable))
+
     # connect to a remote port
     # You must implement this method
 
@@ -244,16 +2242,40 @@ class Socket:
 
 
     def connect(self,address):
+        with self.iocond:
+            self.clienthandshake(address)
+
+    def clienthandshake(self,address):
        self.mysocket.setsockopt(ip.SOL_SOCKET, ip.SO_SNDBUF, 8192)
 
        self.serveraddress = address
-       self.sendtomyversion(0,0,address)
-       A = time.time()
-       self.recvfrommyverison(0,2)
+       # the SYN or the SYN ACK may be lost, the SYN goes out again with
+       # backoff. Only an answer to the first one is an RTT sample.
+       deadline = None
+       if (self.timeout):
+           deadline = time.time() + self.timeout
+       tries = 0
+       while (True):
+           self.sendtomyversion(0,0,address)
+           A = time.time()
+           wait = RTO_INITIAL * (2 ** tries)
+           if (deadline != None):
+               wait = min(wait, deadline - A)
+           if (wait > 0) and (self.handshakerecv(2, wait)):
+               break
+           tries += 1
+           if (tries > SYN_RETRIES) or ((deadline != None) and (time.time() >= deadline)):
+               raise ip.timeout("timed out")
        B = time.time()
-       self.RTT = (B-A)
+       if (tries == 0):
+           self.RTT = (B-A)
+           self.updatertt(self.RTT)
        self.sendtomyversion(0,2,address)
-       self.startThread()
+       self.lastack = self.mySequenceNumber
+       self.discoverpmtu()
+       self.connected = True
+       if (self.wakeup != None) or (self.engine):
+           self.startservice()
        #(self.mySequenceNumber)
        #(self.otherSequenceNumber)
        #(self.serveraddress)
@@ -261,16 +2283,176 @@ class Socket:
        #('connected!')
        pass
 
+    # serve many clients on this one UDP port: after listen() every datagram
+    # is handed to the connection of the address it came from, a SYN from a
+    # new address starts a connection and accept() returns the connections
+    # in the order their handshakes finished. backlog connections can wait
+    # for accept(), SYNs past that are ignored. Connections start out with
+    # the settings of this socket. Must be called after bind().
+    def listen(self, backlog=LISTEN_BACKLOG):
+        self.backlog = backlog
+        if (self.connections == None):
+            self.connections = {}
+            self.closedcounters = dict.fromkeys(self.counters, 0)
+            self.acceptqueue = collections.deque()
+        if (self.recvring == None):
+            self.recvring = RecvRing()
+        if (self.engine):
+            self.startservice()
+
+    # take the settings of the listener a connection came in on
+    def inherit(self, listener):
+        self.listener = listener
+        self.recvring = listener.recvring
+        self.iocond = listener.iocond
+        self.dupackthreshold = listener.dupackthreshold
+        self.selectiverepeat = listener.selectiverepeat
+        self.flowcontrol = listener.flowcontrol
+        self.recvbuffer = listener.recvbuffer
+        self.rwndsent = listener.recvbuffer
+        self.cc = listener.cc.__class__()
+        self.pacing = listener.pacing
+        self.ackevery = listener.ackevery
+        self.delacktimeout = listener.delacktimeout
+        self.windowpackets = listener.windowpackets
+        self.windowbytes = listener.windowbytes
+        self.mss = listener.mss
+        self.segmentation = listener.segmentation
+        self.pmtudiscovery = listener.pmtudiscovery
+        self.pmtuecho = listener.pmtuecho
+        self.batchmode = listener.batchmode
+        self.engine = listener.engine
+        self.sendbuffer = listener.sendbuffer
+        if (listener.packetpool != None):
+            self.set_packet_pool(listener.packetpool.maxsize)
+
+    # read one datagram on the listening socket and hand it to the
+    # connection it came from. With a timeout, returns False if nothing
+    # arrived in time
+    def demux(self, timeout=None):
+        if (self.serviced) and (timeout != 0.0):
+            return self.waitservice(timeout, self.demux)
+        if (self.reading):
+            return self.waitprogress(timeout)
+        received = self.readreleased(timeout, self.recvpacket)
+        if (received == None):
+            return False
+        self.progress += 1
+        (slot, packet) = received
+        address = self.fromaddress
+        conn = self.connections.get(address)
+        if (packet.cntl & SYN) and not (packet.cntl & ACK):
+            if (conn == None):
+                self.newconnection(packet, address)
+            elif (conn.handshaking):
+                # the client did not get our SYN ACK
+                conn.syntries += 1
+                self.mysocket.sendto(conn.lastpacketrecived.pack(), address)
+            self.recvring.release(slot)
+            return True
+        if (conn == None):
+            self.releasepacket(slot, packet)
+            return True
+        # the client echoes the SYN ACK as its ACK. If that was lost, what
+        # it sends next finishes the handshake as well
+        if (conn.handshaking):
+            conn.handshakedone()
+            self.acceptqueue.append(conn)
+            self.updatewakeup()
+        if (packet.cntl & SYN):
+            self.releasepacket(slot, packet)
+            return True
+        conn.counters['packets_received'] += 1
+        conn.handlepacket(slot, packet)
+        if (len(conn.sendqueue) > 0):
+            conn.drainsendqueue()
+        conn.sendacks()
+        conn.updatewakeup()
+        return True
+
+    # a SYN from a new address, answer it with a SYN ACK from a new
+    # connection unless the backlog is full of connections that are
+    # half-open or wait for accept()
+    def newconnection(self, packet, address):
+        if (len(self.acceptqueue) + self.halfopen >= self.backlog):
+            self.counters['listen_drops'] += 1
+            return
+        conn = Socket(self.mysocket)
+        conn.inherit(self)
+        packet.data = b''
+        conn.handlesyn(packet, address)
+        conn.synacktime = time.time()
+        conn.sendtomyversion(0,1,address)
+        conn.handshaking = True
+        conn.synacktimer = scheduler.schedule(conn.synacktime + RTO_INITIAL, conn.synackexpired)
+        self.connections[address] = conn
+        self.halfopen += 1
+
+    # the client ACKed the SYN ACK, the connection is open. Only an ACK of
+    # a SYN ACK that was sent once is an RTT sample.
+    def handshakedone(self):
+        self.transmitqueue.clear()
+        if (self.syntries == 0):
+            self.RTT = time.time() - self.synacktime
+            self.updatertt(self.RTT)
+        self.lastack = self.mySequenceNumber
+        self.handshaking = False
+        self.connected = True
+        self.listener.halfopen -= 1
+        scheduler.cancel(self.synacktimer)
+        self.synacktimer = None
+
+    # timer callback: no ACK of our SYN ACK yet, send it again with backoff,
+    # or give up on the connection. Runs on the scheduler thread.
+    def synackexpired(self, timer):
+        listener = self.listener
+        with self.iocond:
+            if (self.synacktimer is not timer) or (not self.handshaking):
+                return
+            if (self.syntries >= SYNACK_RETRIES):
+                self.handshaking = False
+                self.synacktimer = None
+                listener.halfopen -= 1
+                listener.counters['handshake_timeouts'] += 1
+                if (listener.connections.get(self.clientaddress) is self):
+                    del listener.connections[self.clientaddress]
+                return
+            self.syntries += 1
+            # armed first, a failed send is tried again like a lost SYN ACK
+            self.synacktimer = scheduler.schedule(time.time() + RTO_INITIAL * (2 ** self.syntries), self.synackexpired)
+            self.mysocket.sendto(self.lastpacketrecived.pack(), self.clientaddress)
+
     #accept a connection
+    # On a socket that listens this returns (connection, address) of the next
+    # client, waiting for one to connect if there is none
     def accept(self):
+        if (self.connections != None):
+            with self.iocond:
+                self.raiseerror()
+                if (not self.waitfor(lambda: len(self.acceptqueue) > 0, self.deadline())):
+                    raise self.timedout()
+                conn = self.acceptqueue.popleft()
+                self.updatewakeup()
+                self.counters['accepted'] += 1
+                conn.discoverpmtu()
+                return (conn, conn.clientaddress)
+        with self.iocond:
+            self.serverhandshake()
+
+    def serverhandshake(self):
         self.mysocket.setsockopt(ip.SOL_SOCKET, ip.SO_SNDBUF, 8192)
-        self.recvfrommyverison(0,0)
+        self.serverhandshakerecv(0)
         self.sendtomyversion(0,1,self.clientaddress)
         A = time.time()
-        self.recvfrommyverison(0,1)
+        self.serverhandshakerecv(1)
         B = time.time()
         self.RTT = (B-A)
-        self.startThread()
+        self.updatertt(self.RTT)
+        self.lastack = self.mySequenceNumber
+        self.discoverpmtu()
+        self.connected = True
+        if (self.wakeup != None) or (self.engine):
+            self.startservice()
         #(self.mySequenceNumber)
         #(self.otherSequenceNumber)
         #(self.clientaddress)
@@ -279,6 +2461,30 @@ class Socket:
         pass
 
 
+    # wait for a handshake packet at most timeout seconds (None for no
+    # limit), returns whether it came. Nothing else sends on the socket
+    # before the handshake is over, so a socket timeout does here
+    def handshakerecv(self, mode, timeout=None):
+        if (timeout != None):
+            self.mysocket.settimeout(timeout)
+        try:
+            self.recvfrommyverison(0,mode)
+            return True
+        except ip.timeout:
+            return False
+        finally:
+            if (timeout != None):
+                self.mysocket.settimeout(None)
+
+    # a handshake packet on the accepting side, at most the socket timeout.
+    # Non-blocking sockets wait for it like blocking ones.
+    def serverhandshakerecv(self, mode):
+        timeout = None
+        if (self.timeout):
+            timeout = self.timeout
+        if (not self.handshakerecv(mode, timeout)):
+            raise ip.timeout("timed out")
+
     def sendtomyversion(self,buffer,mode,address):
         #synchro mode, from client
         if mode == 0:
@@ -288,8 +2494,12 @@ class Socket:
             self.mySequenceNumber = SYNPacket.seq
             SYNPacket.ack = 0
             SYNPacket.size = 0
+            if (self.features() != 0):
+                SYNPacket.options = self.synoptions(OPT_SYN_OFFER)
            # SYNPacket.toHex()
 
+            # a SYN sent again replaces the first one
+            self.transmitqueue.clear()
             self.transmitqueue.append(SYNPacket)
             buffer = SYNPacket.pack()
             self.mysocket.sendto(buffer, address)
@@ -325,6 +2535,27 @@ class Socket:
 
 
 
+    # a SYN from address: take its sequence number, agree on the features it
+    # offered and turn it into our SYN ACK
+    def handlesyn(self, packet, address):
+        self.otherSequenceNumber = packet.seq
+        packet.ack = packet.seq
+        packet.cntl = packet.cntl | ACK
+        packet.seq = 0x2be6
+        self.mySequenceNumber = packet.seq
+        # answer an offer of features with the ones both sides support, a
+        # client that offered nothing gets a SYN ACK without options
+        offered = (packet.options != None) and (OPT_SYN_OFFER in packet.options)
+        self.setfeatures(self.features() & packet_features(packet, OPT_SYN_OFFER))
+        self.handlewindow(packet)
+        packet.options = None
+        if (offered):
+            packet.options = self.synoptions(OPT_SYN_ACCEPT)
+        self.lastpacketrecived = packet
+        self.clientaddress = address
+        #(packet.ack)
+        #(packet.seq)
+
     def recvfrommyverison(self,nbytes,mode):
 
         #syncromode, from server recieve packet and set it up
@@ -332,15 +2563,7 @@ class Socket:
             buffer = self.mysocket.recvfrom(1000)
             packet = Packet()
             packet.unpack(buffer[0])
-            self.otherSequenceNumber = packet.seq
-            packet.ack = packet.seq
-            packet.cntl = packet.cntl | ACK
-            packet.seq = 0x2be6
-            self.mySequenceNumber = packet.seq
-            self.lastpacketrecived = packet
-            self.clientaddress = buffer[1]
-            #(packet.ack)
-            #(packet.seq)
+            self.handlesyn(packet, buffer[1])
 
         ##This function deals with getting recving the data, and comparing
         elif mode == 1:
@@ -366,6 +2589,10 @@ class Socket:
             buffer = self.mysocket.recvfrom(1000)
             packet = Packet()
             packet.unpack(buffer[0])
+            # anything but the SYN ACK is not part of the handshake
+            while not ((packet.cntl & SYN) and (packet.cntl & ACK)):
+                buffer = self.mysocket.recvfrom(1000)
+                packet.unpack(buffer[0])
             self.serveraddress = buffer[1]
             flag = False
             for i in range(len(self.transmitqueue)):
@@ -381,6 +2608,10 @@ class Socket:
             self.otherSequenceNumber = packet.seq
             packet.ack = packet.seq
             packet.seq = 0
+            # a server that did not accept a feature does not get it
+            self.setfeatures(self.features() & packet_features(packet, OPT_SYN_ACCEPT))
+            self.handlewindow(packet)
+            packet.options = None
             self.lastpacketrecived = packet
 
 
@@ -446,225 +2677,652 @@ class Socket:
             #('Problem on the high seas! ')
             a = 7
 
-    def startThread(self):
-
-    # create the thread
-     thread1 = transmittingThread(self.RTT,self.mysocket,self.serveraddress,self.clientaddress)
-
-    # you must make it a daemon thread so that the thread will
-    # exit when the main thread does.
-     thread1.daemon = True
-
-    # run the thread
-     thread1.start()
-
-
-
-    # You must implement this method
-
-
-    #here we just send what is necessary, by creating the neceessary packet, incrementing the number and then sending the packet over
+    # current RTT estimate, timeout and counters of this connection
+    def get_stats(self):
+        with self.lock:
+            stats = dict(self.counters)
+            stats['srtt'] = self.srtt
+            stats['rttvar'] = self.rttvar
+            stats['rto'] = self.rto
+            stats['backoff'] = self.backoff
+            stats['inflight'] = len(self.outstanding)
+            stats['inflight_bytes'] = self.inflightbytes
+            stats['selective_repeat'] = self.selectiverepeat
+            stats['congestion_control'] = self.cc.name
+            stats['cwnd'] = self.cc.cwnd
+            stats['ssthresh'] = self.cc.ssthresh
+            stats['pacing'] = self.pacing
+            stats['pacing_rate'] = self.pacingrate()
+            stats['flow_control'] = self.flowcontrol
+            stats['recv_window'] = self.recvwindow()
+            stats['peer_window'] = self.peerwindow
+            stats['reorder'] = len(self.reorder)
+            stats['mss'] = self.mss
+            stats['segmentation'] = self.segmentation
+            stats['pmtu'] = self.pmtu
+            stats['batch_send'] = self.batchmode
+            stats['batch_recv'] = self.batchrecv
+            stats['engine'] = self.engine
+            stats['send_queue'] = self.sendqueuebytes
+            stats['recv_ring'] = 0
+            if (self.recvring != None):
+                stats['recv_ring'] = self.recvring.allocated
+            if (self.connections != None):
+                stats['connections'] = len(self.connections)
+        return stats
+
+    # for a listener, its counters and those of every connection it has
+    # had, summed, and how many connections are open
+    def get_total_stats(self):
+        with self.iocond:
+            conns = list(self.connections.values())
+            totals = dict(self.counters)
+            for (key, value) in self.closedcounters.items():
+                totals[key] += value
+        for conn in conns:
+            for (key, value) in conn.counters.items():
+                totals[key] += value
+        totals['connections'] = len(conns)
+        return totals
+
+    # put a sent packet on the outstanding queue and make sure the
+    # retransmission timer runs, called with the lock held
+    def queuepacket(self, packet):
+        buf = self.newskbuf(packet, time.time())
+        self.outstanding.append(buf)
+        self.inflightbytes += packet.size
+        self.counters['packets_sent'] += 1
+        if (self.rtxdue == 0):
+            self.starttimer()
+        return buf
+
+    # send a new packet and queue it for retransmission, with pacing on it
+    # waits in the pacequeue until the pacer sends it
+    def transmit(self, packet):
+        if (self.pacing):
+            with self.lock:
+                self.pacequeue.append(self.queuepacket(packet))
+                self.pace()
+            return
+        if (self.batchmode != None):
+            self.sendbatch.append(packet.pack())
+            with self.lock:
+                self.queuepacket(packet)
+            if (len(self.sendbatch) >= SEND_BATCH):
+                self.flushbatch()
+            return
+        # queued before it goes out: if the sendto fails the sequence number
+        # is taken all the same, and the retransmit timer covers the packet
+        with self.lock:
+            self.queuepacket(packet)
+            self.counters['send_calls'] += 1
+        self.mysocket.sendto(packet.pack(), self.peeraddress())
+
+    def flushbatch(self):
+        if (len(self.sendbatch) == 0):
+            return
+        buffers = self.sendbatch
+        self.sendbatch = []
+        # the scheduler thread resends through the same MmsgSender, whose
+        # arrays the system call reads with the GIL released
+        with self.lock:
+            self.counters['send_calls'] += self.sendbuffers(buffers, self.peeraddress())
+
+    # send packed packets with the batch mode, returns the number of system
+    # calls. If GSO or sendmmsg fails the next way down is used from then
+    # on, packets that already went out before the failure go twice.
+    def sendbuffers(self, buffers, address):
+        if (self.batchmode == 'gso'):
+            try:
+                return sendgso(self.mysocket, buffers, address)
+            except (ip.error, OSError) as e:
+                dbg_print(1, "sock352: GSO send failed %s" % (e))
+                self.batchmode = 'sendmmsg' if (libc_sendmmsg != None) else 'sendto'
+        if (self.batchmode == 'sendmmsg'):
+            try:
+                if (self.mmsgsender == None):
+                    self.mmsgsender = MmsgSender()
+                return self.mmsgsender.send(self.mysocket, buffers, address)
+            except (ip.error, OSError) as e:
+                dbg_print(1, "sock352: sendmmsg failed %s" % (e))
+                self.batchmode = 'sendto'
+        for buffer in buffers:
+            self.mysocket.sendto(buffer, address)
+        return len(buffers)
+
+    # packets/sec the pacer lets out, 0 until there is an RTT estimate
+    def pacingrate(self):
+        if (self.srtt <= 0.0):
+            return 0.0
+        if (self.cc.cwnd < self.cc.ssthresh):
+            return PACING_SS_GAIN * self.cc.cwnd / self.srtt
+        return PACING_CA_GAIN * self.cc.cwnd / self.srtt
+
+    # token bucket: send queued packets while there are tokens, and if some
+    # are left set a timer for when the next token is due. Called with the
+    # lock held, from transmit and from the pacing timer.
+    def pace(self):
+        now = time.time()
+        rate = self.pacingrate()
+        if (rate <= 0.0):
+            self.tokens = len(self.pacequeue)
+        else:
+            self.tokens = min(self.tokens + (now - self.lastpace) * rate, PACING_BURST)
+        self.lastpace = now
+        address = self.peeraddress()
+        while (len(self.pacequeue) > 0) and (self.tokens >= 1.0):
+            buf = self.pacequeue.popleft()
+            # the RTT is timed from when the packet really went out
+            buf.time_sent = now
+            self.mysocket.sendto(buf.Packet.pack(), address)
+            self.counters['send_calls'] += 1
+            self.tokens -= 1.0
+        if (len(self.pacequeue) > 0) and (self.pacetimer == None):
+            self.counters['paced'] += 1
+            self.pacetimer = scheduler.schedule(now + (1.0 - self.tokens) / rate, self.pacetimeout)
+
+    def pacetimeout(self, timer):
+        with self.lock:
+            if (self.pacetimer is not timer):
+                return
+            self.pacetimer = None
+            self.pace()
+
+    # drop whatever the pacer still holds, called with the lock held
+    def stoppacer(self):
+        if (self.pacetimer != None):
+            scheduler.cancel(self.pacetimer)
+            self.pacetimer = None
+        self.pacequeue.clear()
+
+    # what ProtocolCore needs: the timers run on the scheduler thread, by
+    # time.time()
+    def now(self):
+        return time.time()
+
+    def settimer(self, when, func):
+        return scheduler.schedule(when, func)
+
+    def canceltimer(self, timer):
+        scheduler.cancel(timer)
+
+    # ACKs and probes, called with the lock held
+    def sendpacket(self, packet):
+        self.mysocket.sendto(packet.pack(), self.peeraddress())
+
+    # resent packets go out as one batch when batching is on
+    def resendpackets(self, packets):
+        address = self.peeraddress()
+        if (self.batchmode != None):
+            self.counters['send_calls'] += self.sendbuffers([packet.pack() for packet in packets], address)
+            return
+        for packet in packets:
+            self.mysocket.sendto(packet.pack(), address)
+            self.counters['send_calls'] += 1
+
+    # the other side stopped answering, nothing more is resent. The error
+    # leaves the timer on the scheduler thread, which hands it to the
+    # application (see seterror).
+    def giveup(self, error):
+        raise error
+
+    # set the send window, the most packets and/or bytes that may be sent and
+    # not yet ACKed. 0 means no limit on that unit. sendto blocks, processing
+    # incoming packets, until the window has room for the next packet.
+    def set_window(self, packets=0, nbytes=0):
+        self.windowpackets = packets
+        self.windowbytes = nbytes
+
+    # True while more than half of the packet window is in flight
+    def windowbusy(self):
+        limit = self.cc.window()
+        if (self.windowpackets > 0):
+            limit = min(limit, self.windowpackets)
+        return len(self.outstanding) > limit / 2.0
+
+    # free bytes in our receive buffer, what the peer may still send
+    def recvwindow(self):
+        return max(self.recvbuffer - self.recvqueuebytes, 0)
+
+    # send buffer as one message, the other side gets all of it from one
+    # recvfrom. A message longer than the mss goes out in segments, all but
+    # the last with the MORE flag. A peer that cannot reassemble them gets
+    # the message in one packet, as long as it fits.
     def sendto(self,buffer):
+        with self.iocond:
+            self.raiseerror()
+            deadline = self.deadline()
+            size = len(buffer)
+            if (size <= self.mss) or (not self.segmentation):
+                if (size > MAX_SIZE):
+                    raise ValueError("sock352: message of %d bytes is longer than %d" % (size, MAX_SIZE))
+                self.sendsegment(buffer, DATA, deadline)
+                self.flushbatch()
+                return
+            offset = 0
+            while (offset + self.mss < size):
+                self.sendsegment(buffer[offset:offset + self.mss], DATA | MORE, deadline)
+                deadline = self.nextdeadline(deadline)
+                offset += self.mss
+            self.sendsegment(buffer[offset:], DATA, deadline)
+            self.flushbatch()
+
+    # send a buffer of any size as a run of messages of up to mss bytes, which
+    # the other side reads one recvfrom at a time like a stream. Works with
+    # any peer and holds no reassembly memory on the receiving side.
+    def sendall(self,buffer):
+        with self.iocond:
+            self.raiseerror()
+            deadline = self.deadline()
+            for offset in range(0, len(buffer), self.mss):
+                self.sendsegment(buffer[offset:offset + self.mss], DATA, deadline)
+                deadline = self.nextdeadline(deadline)
+            self.flushbatch()
+
+    # the deadline for the rest of a send once a segment is out, a
+    # non-blocking send does not stop half way
+    def nextdeadline(self, deadline):
+        if (self.timeout == 0.0):
+            return None
+        return deadline
 
-        if len(self.ackqueue) != 0:
-            while len(self.ackqueue) > 0:
-             for i in range(len(self.ackqueue)):
-                newPacket = self.ackqueue[i]
-                newPacket.cntl = ACK
-                newPacket.ack = newPacket.seq
-                newPacket.seq = 0
-                newPacket.data = b''
-                newPacket.size = 0
-                #newPacket.toHex
-                newPackedPacket = newPacket.pack()
-                if(self.serveraddress == 0):
-                    self.mysocket.sendto(newPackedPacket, self.clientaddress)
-                else:
-                 a = 6
-                 self.mysocket.sendto(newPackedPacket, self.serveraddress)
-                self.ackqueue.remove(self.ackqueue[i])
-                break
-
-
-
-        newPacket = Packet()
+    #here we just send what is necessary, by creating the neceessary packet, incrementing the number and then sending the packet over
+    # if the window is full we keep receiving until enough of it has been ACKed
+    def sendsegment(self,buffer,cntl,deadline=None):
+        if (self.engine):
+            self.queuesegment(buffer, cntl, deadline)
+            return
+        self.sendacks()
+        if (self.windowfull(len(buffer))):
+            # while a batch is being collected wait for half the window, not
+            # the packet or two one ACK frees, so the next batch is worth a
+            # system call
+            batching = (len(self.sendbatch) > 0)
+            ready = lambda: not (self.windowfull(len(buffer)) or (batching and self.windowbusy()))
+            if (not self.waitfor(ready, deadline)) and (self.windowfull(len(buffer))):
+                raise self.timedout()
+        self.sendnow(buffer, cntl)
+
+    # with the engine a segment waits in the sendqueue until the window has
+    # room for it, the caller only waits while the queue is full
+    def queuesegment(self, buffer, cntl, deadline):
+        if (self.sendqueuebytes >= self.sendbuffer):
+            if (not self.waitfor(lambda: self.sendqueuebytes < self.sendbuffer, deadline)):
+                raise self.timedout()
+        self.sendqueue.append((buffer, cntl))
+        self.sendqueuebytes += len(buffer)
+        self.drainsendqueue()
+
+    # send the queued segments the window has room for
+    def drainsendqueue(self):
+        while (len(self.sendqueue) > 0) and (not self.windowfull(len(self.sendqueue[0][0]))):
+            (buffer, cntl) = self.sendqueue.popleft()
+            self.sendqueuebytes -= len(buffer)
+            self.sendnow(buffer, cntl)
+        self.flushbatch()
+
+    # put a segment on the wire, the window has room for it
+    def sendnow(self,buffer,cntl):
+        newPacket = self.newpacket()
         newPacket.data = buffer
         newPacket.size = len(buffer)
-        newPacket.cntl = newPacket.cntl | DATA
+        newPacket.cntl = newPacket.cntl | cntl
         self.mySequenceNumber += 1
         newPacket.seq = self.mySequenceNumber
-        newPacket.ack = 0
+        with self.lock:
+            self.piggyback(newPacket)
         #newPacket.toHex()
-        newPackedPacket = newPacket.pack()
-        if(self.serveraddress == 0):
-            self.mysocket.sendto(newPackedPacket, self.clientaddress)
-        elif self.clientaddress == 0:
-            self.mysocket.sendto(newPackedPacket, self.serveraddress)
-        AA = skbuf(newPacket, time.time())
-        list_of_outstanding_packets.append(AA)
-        self.transmitqueue.append(newPacket)
-
-
-
-        pass
-
-
-
-
-
+        self.transmit(newPacket)
+
+
+    # read one datagram from the UDP socket into a free slot of the receive ring
+    # returns (slot, packet), the packet data is a memoryview into the slot and is
+    # only valid until the slot is released. Without wait, EAGAIN is raised
+    # when there is no datagram
+    def recvpacket(self, wait=True):
+        if (self.recvring == None):
+            self.recvring = RecvRing()
+        ring = self.recvring
+        slot = ring.acquire()
+        view = ring.slots[slot]
+        flags = 0
+        if (not wait):
+            flags = MSG_DONTWAIT
+        try:
+            (nbytes, address) = self.mysocket.recvfrom_into(view, 0, flags)
+            self.counters['recv_calls'] += 1
+            # runt datagrams that cannot hold a header are dropped here, and so
+            # is the set_drop_prob share of the traffic
+            while (nbytes < HEADER_LEN) or self.dropped():
+                (nbytes, address) = self.mysocket.recvfrom_into(view, 0, flags)
+                self.counters['recv_calls'] += 1
+        except:
+            ring.release(slot)
+            raise
+        self.fromaddress = address
+        packet = self.newpacket()
+        (packet.type, packet.cntl, packet.seq, packet.ack, packet.size) = HEADER_STRUCT.unpack_from(view)
+        packet.data = view[HEADER_LEN:nbytes]
+        if (packet.cntl & OPTIONS):
+            (packet.options, packet.data) = unpack_options(packet.data)
+        return (slot, packet)
+
+    # read at least one datagram, with batched receive every one that is
+    # waiting. Returns a list of (slot, packet) like recvpacket, without
+    # wait None when nothing is waiting
+    def recvpackets(self, wait=True):
+        if (self.batchrecv == None):
+            return [self.recvpacket(wait)]
+        if (self.recvring == None):
+            self.recvring = RecvRing()
+        if (self.mmsgreceiver == None):
+            self.mmsgreceiver = MmsgReceiver(self.recvring)
+        ring = self.recvring
+        flags = MSG_WAITFORONE
+        if (not wait):
+            flags = MSG_DONTWAIT
+        packets = []
+        while (len(packets) == 0):
+            try:
+                received = self.mmsgreceiver.receive(self.mysocket, flags)
+            except (ip.error, OSError) as e:
+                dbg_print(1, "sock352: recvmmsg failed %s" % (e))
+                self.set_batched_recv(False)
+                return [self.recvpacket(wait)]
+            if (len(received) == 0):
+                return None
+            self.counters['recv_calls'] += 1
+            # parsed like in recvpacket, with the lookups taken out of the loop
+            views = ring.slots
+            newpacket = self.newpacket
+            unpack_from = HEADER_STRUCT.unpack_from
+            dropping = (self.dropprob > 0.0)
+            for (slot, nbytes) in received:
+                if (nbytes < HEADER_LEN) or (dropping and self.dropped()):
+                    ring.release(slot)
+                    continue
+                view = views[slot]
+                packet = newpacket()
+                (packet.type, packet.cntl, packet.seq, packet.ack, packet.size) = unpack_from(view)
+                packet.data = view[HEADER_LEN:nbytes]
+                if (packet.cntl & OPTIONS):
+                    (packet.options, packet.data) = unpack_options(packet.data)
+                packets.append((slot, packet))
+        return packets
+
+    # a retransmission may have got there before the pacer sent it, the
+    # rest is ProtocolCore.retire. Called with the lock held.
+    def retire(self, ack):
+        pacequeue = self.pacequeue
+        while (len(pacequeue) > 0) and (pacequeue[0].Packet.seq <= ack):
+            pacequeue.popleft()
+        ProtocolCore.retire(self, ack)
+
+    # process one received packet: retire what it ACKs, queue in order data for
+    # the application and ACK it. A retransmission of something we already have
+    # is ACKed again, since the first ACK must have been lost.
+    def handlepacket(self, slot, packet):
+        # the SYN ACK again, our ACK of it was lost
+        if (packet.cntl & SYN):
+            self.ackqueue.append(self.otherSequenceNumber)
+            self.releasepacket(slot, packet)
+            return
+        if (packet.options != None) and (OPT_PMTU in packet.options):
+            self.handlepmtu(packet)
+            self.releasepacket(slot, packet)
+            return
+        self.handlewindow(packet)
+        if (packet.cntl & ACK) and (len(self.outstanding) != 0):
+            self.handleack(packet)
+
+        expectedseq = self.otherSequenceNumber
+        if (packet.cntl & PROBE):
+            # answer with an ACK, which carries our window
+            self.ackqueue.append(expectedseq)
+        elif packet.seq == expectedseq+1:
+            self.deliver(slot, packet)
+            if (self.remoteclosed) or (len(self.reorder) > 0):
+                # packets held in the reorder buffer may follow on from this
+                # one, the sender wants to hear at once that the hole is filled
+                while (len(self.reorder) > 0) and ((self.otherSequenceNumber + 1) in self.reorder):
+                    (slot, packet) = self.reorder.pop(self.otherSequenceNumber + 1)
+                    self.deliver(slot, packet)
+                self.ackqueue.append(self.otherSequenceNumber)
+            else:
+                self.delayack()
+            return
+        elif (packet.seq != 0) and (packet.seq <= expectedseq):
+            self.ackqueue.append(packet.seq)
+        elif (packet.seq > expectedseq+1):
+            # a packet before this one was lost. The last cumulative ACK is
+            # repeated, the sender counts these duplicates. Go back N throws
+            # this packet away, selective repeat keeps it until the hole is filled
+            self.ackqueue.append(expectedseq)
+            if (self.selectiverepeat) and (packet.seq <= expectedseq + REORDER_LIMIT) and (packet.seq not in self.reorder):
+                self.reorder[packet.seq] = (self.detach(slot, packet), packet)
+                return
+        self.recvring.release(slot)
+        self.freepacket(packet)
+
+    # the next packet in sequence has arrived, hand its data to the application
+    def deliver(self, slot, packet):
+        self.otherSequenceNumber += 1
+        if (packet.cntl & FIN):
+            self.remoteclosed = True
+            self.releasepacket(slot, packet)
+        elif (packet.cntl & MORE) or (self.partial != None):
+            self.reassemble(slot, packet)
+        else:
+            self.recvqueue.append((self.detach(slot, packet), packet))
+            self.recvqueuebytes += len(packet.data)
+
+    # a packet that is going to wait holds its ring slot. If the ring has no
+    # free slot left a short payload is copied out and the slot given back,
+    # so unread messages cost about their size and do not make the ring grow.
+    # Returns the slot the packet still holds.
+    def detach(self, slot, packet):
+        if (slot == None) or (len(self.recvring.free) > 0) or (len(packet.data) >= RECV_COPY_LIMIT):
+            return slot
+        packet.data = memoryview(packet.data.tobytes())
+        self.recvring.release(slot)
+        self.counters['recv_copies'] += 1
+        return None
+
+    # segments are copied out of the receive ring as they arrive, so a long
+    # message does not hold on to ring slots. The last one (without MORE)
+    # queues the message, with no slot. Only whole messages count against
+    # the receive window, one longer than the buffer could never be read.
+    def reassemble(self, slot, packet):
+        if (self.partial == None):
+            self.partial = bytearray()
+        self.partial += packet.data
+        if (slot != None):
+            self.recvring.release(slot)
+        if (packet.cntl & MORE):
+            self.freepacket(packet)
+            return
+        packet.data = memoryview(self.partial)
+        self.partial = None
+        self.recvqueue.append((None, packet))
+        self.recvqueuebytes += len(packet.data)
+        self.counters['reassembled'] += 1
+
+    # give back a received packet, and its ring slot if the data is in the ring
+    def releasepacket(self, slot, packet):
+        if (slot != None):
+            self.recvring.release(slot)
+        self.freepacket(packet)
+
+    # a pure ACK followed in the same batch by a higher ACK, which retires all
+    # it would and carries a newer window, can be skipped. Not one followed by
+    # the same ACK, which would then not count as a duplicate.
+    def supersededack(self, packet, following):
+        return ((packet.cntl & ~OPTIONS) == ACK) and (following.cntl & ACK) and \
+               (following.ack > packet.ack) and (packet.ack > self.lastack) and \
+               ((packet.options == None) or ((OPT_SACK not in packet.options) and (OPT_PMTU not in packet.options)))
+
+    # receive and process one packet, with batched receive all that are
+    # waiting, then send the ACKs they produced.
+    # With a timeout, returns False if nothing arrived in time
+    def pump(self, timeout=None):
+        # nothing waits for an ACK of a packet that was never sent
+        self.flushbatch()
+        # a connection of a listener reads through it, what arrives may be
+        # for another connection on the same port
+        if (self.listener != None):
+            return self.listener.demux(timeout)
+        if (self.connections != None):
+            return self.demux(timeout)
+        if (self.serviced) and (timeout != 0.0):
+            return self.waitservice(timeout, self.pump)
+        if (self.reading):
+            return self.waitprogress(timeout)
+        packets = self.readreleased(timeout, self.recvpackets)
+        if (packets == None):
+            return False
+        self.progress += 1
+        self.counters['packets_received'] += len(packets)
+        last = len(packets) - 1
+        for i in range(len(packets)):
+            (slot, packet) = packets[i]
+            if (i < last) and self.supersededack(packet, packets[i + 1][1]):
+                self.counters['coalesced_acks'] += 1
+                self.releasepacket(slot, packet)
+                continue
+            self.handlepacket(slot, packet)
+        if (len(self.sendqueue) > 0):
+            self.drainsendqueue()
+        self.sendacks()
+        self.updatewakeup()
+        return True
+
+    def dropped(self):
+        if (self.dropprob > 0.0) and (self.random.random() < self.dropprob):
+            self.counters['dropped'] += 1
+            return True
+        return False
+
+    # a view handed out by recvfrom_view stays valid until the next receive call
+    def releaseheld(self):
+        if (self.heldslot != None):
+            (slot, packet) = self.heldslot
+            self.releasepacket(slot, packet)
+            self.heldslot = None
+
+    # Basically keep polling until the next in order data packet is there. Data
+    # that arrived while sendto was waiting on the window is already queued.
+    # returns the ring slot and packet, the caller must release the slot, or
+    # None once the other side has closed and everything has been read
+    def recvdata(self):
+        self.releaseheld()
+        self.raiseerror()
+        ready = lambda: (len(self.recvqueue) > 0) or (self.remoteclosed)
+        if (not self.waitfor(ready, self.deadline())):
+            raise self.timedout()
+        if (len(self.recvqueue) == 0):
+            return None
+        (slot, packet) = self.recvqueue.popleft()
+        self.recvqueuebytes -= len(packet.data)
+        self.updatewakeup()
+        # the window we advertised was small and reading has opened it up
+        # again, tell the sender, it may be waiting for this
+        if (self.flowcontrol) and (self.rwndsent < self.recvbuffer // 2) and (self.recvwindow() >= self.recvbuffer // 2):
+            self.counters['window_updates'] += 1
+            self.ackqueue.append(self.otherSequenceNumber)
+            self.sendacks()
+        return (slot, packet)
 
 # receive a message up to MAX_DATA
     # You must implement this method
-
-
-    # Basically keep polling, first we check whether or not we need any future acks from messages we've sent in the past, if not then we simply just
-    # keep waiting until we get the message that is to be expected, once both conditions are fulfilled, or one of them then recv returns, otherwise it keeps blocking
+    # the payload is copied once out of the receive ring into a new string
+    # returns b'' once the other side has closed
     def recvfrom(self,nbytes):
-
-      Flag = True
-      while Flag:
-      # ('stuck in recv loop')
-       buffer = self.mysocket.recvfrom(MAX_SIZE)
-      # ('kj % i' % nbytes)
-       packet = Packet()
-       packet.unpack(buffer[0])
-       flag1 = False
-       flag2 = False
-
-       if(len(self.transmitqueue) == 0):
-           flag2 = True
-       else:
-        for i in range(len(self.transmitqueue)):
-          # (self.transmitqueue[i].seq)
-          # (packet.seq)
-         # (i)
-          if self.transmitqueue[i].seq == packet.ack:
-              self.transmitqueue.remove(self.transmitqueue[i])
-
-              break
-        for i in list_of_outstanding_packets:
-            if(i.Packet.seq == packet.ack):
-                list_of_outstanding_packets.remove(i)
-
-
-
-
-       expectedseq = self.otherSequenceNumber
-      # (expectedseq)
-      # (packet.seq)
-       if packet.seq == expectedseq+1:
-           self.otherSequenceNumber += 1
-           a = 6
-           self.ackqueue.append(packet)
-         #  ('EXITED recv loop')
-           return packet.data
-       pass
+        with self.iocond:
+            received = self.recvdata()
+            if (received == None):
+                return b''
+            (slot, packet) = received
+            data = packet.data.tobytes()
+            self.releasepacket(slot, packet)
+            return data
+
+    # receive a message straight into a caller supplied buffer (bytearray,
+    # memoryview, array...), the only copy is from the receive ring into the buffer.
+    # Like a datagram socket, anything that does not fit is discarded.
+    # returns the number of bytes written, 0 once the other side has closed
+    def recv_into(self,buffer,nbytes=0):
+        with self.iocond:
+            received = self.recvdata()
+            if (received == None):
+                return 0
+            (slot, packet) = received
+            if (nbytes == 0) or (nbytes > len(buffer)):
+                nbytes = len(buffer)
+            if (nbytes > len(packet.data)):
+                nbytes = len(packet.data)
+            if (not isinstance(buffer, memoryview)):
+                buffer = memoryview(buffer)
+            buffer[:nbytes] = packet.data[:nbytes]
+            self.releasepacket(slot, packet)
+            return nbytes
+
+    # zero copy receive, returns a memoryview of the payload inside the receive
+    # ring (or of the reassembled message). The view is only valid until the
+    # next receive call on this socket. An empty view once the other side
+    # has closed.
+    def recvfrom_view(self,nbytes):
+        with self.iocond:
+            received = self.recvdata()
+            if (received == None):
+                return memoryview(b'')
+            self.heldslot = received
+            return received[1].data
 
 
 
     #This function deals with sending the closing packets, however another function is called just before that deals with any outstanding packets
     def sendclosingpacket(self):
-        if len(self.ackqueue) != 0:
-            while len(self.ackqueue) > 0:
-             for i in range(len(self.ackqueue)):
-                newPacket = self.ackqueue[i]
-                newPacket.cntl = ACK
-                newPacket.ack = newPacket.seq
-                newPacket.seq = 0
-                newPacket.data = b''
-                newPacket.size = 0
-                #newPacket.toHex
-                newPackedPacket = newPacket.pack()
-                if(self.serveraddress == 0):
-                    self.mysocket.sendto(newPackedPacket, self.clientaddress)
-                else:
-                 a = 6
-                 self.mysocket.sendto(newPackedPacket, self.serveraddress)
-                self.ackqueue.remove(self.ackqueue[i])
-                break
+        self.sendacks()
 
-
-
-
-
-
-        packet = Packet()
+        packet = self.newpacket()
         packet.cntl = packet.cntl | FIN
-        packet.ack = 0
         self.mySequenceNumber += 1
         packet.seq = self.mySequenceNumber
+        with self.lock:
+            self.piggyback(packet)
         #packet.toHex()
-        newPackedPacket = packet.pack()
-        if (self.serveraddress == 0):
-            self.mysocket.sendto(newPackedPacket, self.clientaddress)
-        elif self.clientaddress == 0:
-            self.mysocket.sendto(newPackedPacket, self.serveraddress)
-        AA = skbuf(packet, time.time())
-        list_of_outstanding_packets.append(AA)
-        self.transmitqueue.append(packet)
-
-
-    def recvfromforclosing(self):
-        Flag = True
-        while Flag:
-           # ('stuck in recv loop')
-            buffer = self.mysocket.recvfrom(MAX_SIZE)
-            packet = Packet()
-            packet.unpack(buffer[0])
-            flag1 = False
-            flag2 = False
+        self.transmit(packet)
+        self.flushbatch()
 
-            if (len(self.transmitqueue) == 0):
-                flag2 = True
-            else:
-                for i in range(len(self.transmitqueue)):
-                    # (self.transmitqueue[i].seq)
-                    # (packet.seq)
-                  #  (i)
-                    if self.transmitqueue[i].seq == packet.ack:
-                        self.transmitqueue.remove(self.transmitqueue[i])
-                      #  ('reached')
-                        break
 
-            for i in list_of_outstanding_packets:
-                 if (i.Packet.seq == packet.ack):
-                    list_of_outstanding_packets.remove(i)
+    # how long close() waits on the other side, see settimeout
+    def closedeadline(self):
+        if (self.timeout == None):
+            return None
+        return time.time() + max(self.timeout, CLOSE_LINGER_RTOS * self.rto)
 
-            expectedseq = self.otherSequenceNumber
-          #  (expectedseq)
-         #   (packet.seq)
-
-            if packet.seq == expectedseq + 1 or packet.cntl == FIN:
-                 self.otherSequenceNumber += 1
-                 a = 6
-                 self.ackqueue.append(packet)
-               #  ('EXITED recv loop')
-                 return packet.data
+    # wait for the FIN from the other side, data the application never read
+    # is thrown away. With a timeout give up on it after that, but not
+    # before a few RTOs.
+    def recvfromforclosing(self):
+        self.releaseheld()
+        self.waitfor(lambda: self.remoteclosed, self.closedeadline())
+        while len(self.recvqueue) > 0:
+            (slot, packet) = self.recvqueue.popleft()
+            self.releasepacket(slot, packet)
+        self.recvqueuebytes = 0
+        self.partial = None
+        for (slot, packet) in self.reorder.values():
+            self.releasepacket(slot, packet)
+        self.reorder.clear()
 
 
 
     def sendfinalACK(self):
-            if len(self.ackqueue) != 0:
-                while len(self.ackqueue) > 0:
-                    for i in range(len(self.ackqueue)):
-                        newPacket = self.ackqueue[i]
-                        newPacket.cntl = ACK
-                        newPacket.ack = newPacket.seq
-                        newPacket.seq = 0
-                        newPacket.data = b''
-                        newPacket.size = 0
-                        # newPacket.toHex
-                        newPackedPacket = newPacket.pack()
-                        try:
-                         if (self.serveraddress == 0):
-                            self.mysocket.sendto(newPackedPacket, self.clientaddress)
-                         else:
-                            a = 6
-                            self.mysocket.sendto(newPackedPacket, self.serveraddress)
-                        except:
-                            a = 6
-                        self.ackqueue.remove(self.ackqueue[i])
-                        break
+        try:
+            self.sendacks()
+        except:
+            a = 6
 
 
 
@@ -673,15 +3331,198 @@ class Socket:
     # You must implement this method         
     def close(self):
      #   ('inside close')
+        with self.iocond:
+            self.closeconnection()
+            self.closewakeup()
+
+    def closeconnection(self):
+        # a listener stops taking connections, the ones it has keep the UDP
+        # socket
+        if (self.connections != None):
+            for conn in self.acceptqueue:
+                self.connections.pop(conn.clientaddress, None)
+            self.acceptqueue.clear()
+            self.backlog = 0
+            self.updatewakeup()
+            return
+        # the engine sends what is still queued before the FIN, what the
+        # timeout leaves no time for is dropped
+        if (len(self.sendqueue) > 0):
+            self.waitfor(lambda: len(self.sendqueue) == 0, self.closedeadline())
+            self.sendqueue.clear()
+            self.sendqueuebytes = 0
         self.sendclosingpacket()
         self.recvfromforclosing()
         self.sendfinalACK()
+        # linger a few RTOs until our own FIN is ACKed, so a lost FIN still gets
+        # retransmitted, but don't wait for an ACK the other side may never send
+        deadline = time.time() + CLOSE_LINGER_RTOS * self.rto
+        while (len(self.outstanding) > 0):
+            left = deadline - time.time()
+            if (left <= 0):
+                break
+            self.pump(left)
+        # the other side has closed too, stop retransmitting to it
+        with self.lock:
+            self.stoptimer()
+            self.stoppacer()
+            self.stopprobe()
+            self.stopdelack()
+            self.rtxqueue.clear()
+        self.stopservice()
+        # what the address sends after this is for a new connection
+        if (self.listener != None):
+            self.listener.connections.pop(self.clientaddress, None)
+            for (key, value) in self.counters.items():
+                self.listener.closedcounters[key] += value
         #(len(self.ackqueue))
        # (len(self.transmitqueue))
-       # (len(list_of_outstanding_packets))
+       # (len(self.outstanding))
        # (len(self.ackqueue))
 
-        pass
+    # the fileno of a closed connection is of no use any more, a listener
+    # keeps it for the connections still open
+    def closewakeup(self):
+        if (self.wakeup != None) and (self.connections == None):
+            self.wakeup[0].close()
+            self.wakeup[1].close()
+            self.wakeup = None
+
+# the body of a worker process: listen on the shared port, answer the
+# supervisor's requests for statistics and serve with target. The fork
+# copied the supervisor's ends of the pipes, which are closed so that the
+# worker sees its own pipe close when the supervisor goes away.
+def run_worker(address, backlog, target, pipe, inherited):
+    for end in inherited:
+        end.close()
+    listener = Socket()
+    listener.set_reuse_port()
+    listener.bind(address)
+    listener.listen(backlog)
+    thread = threading.Thread(target=answer_stats, args=(listener, pipe))
+    thread.daemon = True
+    thread.start()
+    target(listener)
+
+# a worker whose supervisor is gone exits, nothing would start it again
+def answer_stats(listener, pipe):
+    try:
+        while (True):
+            pipe.recv()
+            pipe.send(listener.get_total_stats())
+    except (EOFError, IOError, OSError):
+        os._exit(0)
+
+# serve one port from workers processes, for as many cores' worth of packet
+# processing. Each worker binds the port with SO_REUSEPORT, has its own
+# listener, demultiplexer and scheduler thread, and calls target(listener)
+# to accept and serve the connections the kernel hands it. check() (which
+# serve_forever calls every interval) starts the workers that died again.
+# The connections of a worker die with it, and while the set of workers
+# changes the kernel may move some flows to another worker, which drops
+# them. The workers are forked, so target can be any function.
+class Supervisor(object):
+    def __init__(self, address, target, workers=None, backlog=LISTEN_BACKLOG):
+        if (not REUSEPORT_SUPPORTED):
+            raise ValueError("sock352: SO_REUSEPORT needs Linux")
+        if (workers == None):
+            workers = multiprocessing.cpu_count()
+        if (workers < 1):
+            raise ValueError("sock352: need at least one worker")
+        self.address = address
+        self.target = target
+        self.backlog = backlog
+        self.workers = [None] * workers
+        self.pipes = [None] * workers
+        self.restarts = 0
+        self.running = False
+        self.context = multiprocessing
+        if (hasattr(multiprocessing, 'get_context')):
+            self.context = multiprocessing.get_context('fork')
+
+    def start(self):
+        # every worker needs the same port, a port of 0 is picked here
+        if (self.address[1] == 0):
+            probe = ip.socket(ip.AF_INET, ip.SOCK_DGRAM)
+            probe.setsockopt(ip.SOL_SOCKET, SO_REUSEPORT, 1)
+            probe.bind(self.address)
+            self.address = (self.address[0], probe.getsockname()[1])
+            probe.close()
+        self.running = True
+        for index in range(len(self.workers)):
+            self.startworker(index)
+
+    def startworker(self, index):
+        (mine, theirs) = self.context.Pipe()
+        inherited = [mine] + [pipe for pipe in self.pipes if (pipe != None) and (not pipe.closed)]
+        worker = self.context.Process(target=run_worker, args=(self.address, self.backlog, self.target, theirs, inherited))
+        worker.daemon = True
+        worker.start()
+        theirs.close()
+        self.workers[index] = worker
+        self.pipes[index] = mine
+
+    def stopworker(self, index):
+        worker = self.workers[index]
+        if (worker.is_alive()):
+            worker.terminate()
+        worker.join()
+        self.pipes[index].close()
+
+    # start the workers that died again, returns how many
+    def check(self):
+        count = 0
+        for index in range(len(self.workers)):
+            if (not self.workers[index].is_alive()):
+                self.stopworker(index)
+                self.startworker(index)
+                self.restarts += 1
+                count += 1
+        return count
+
+    # replace a worker with a new one
+    def restart(self, index):
+        self.stopworker(index)
+        self.startworker(index)
+        self.restarts += 1
+
+    def serve_forever(self, interval=SUPERVISE_INTERVAL):
+        while (self.running):
+            self.check()
+            time.sleep(interval)
+
+    def stop(self):
+        self.running = False
+        for index in range(len(self.workers)):
+            if (self.workers[index] != None):
+                self.stopworker(index)
+
+    # the counters of all workers summed (see Socket.get_total_stats), how
+    # many workers answered and how many were started again. A worker that
+    # does not answer within timeout seconds is left out.
+    def get_stats(self, timeout=1.0):
+        totals = {}
+        answered = 0
+        for index in range(len(self.workers)):
+            pipe = self.pipes[index]
+            if (not self.workers[index].is_alive()):
+                continue
+            try:
+                # an answer that came too late last time
+                while (pipe.poll()):
+                    pipe.recv()
+                pipe.send('stats')
+                if (not pipe.poll(timeout)):
+                    continue
+                stats = pipe.recv()
+            except (EOFError, IOError, OSError):
+                continue
+            answered += 1
+            for (key, value) in stats.items():
+                totals[key] = totals.get(key, 0) + value
+        totals['workers'] = answered
+        totals['restarts'] = self.restarts
+        return totals
         
 # Example how to start a start the timeout thread
 global sock352_dbg_level 
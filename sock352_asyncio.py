@@ -0,0 +1,773 @@
+# sock352_asyncio.py
+
+# the sock352 protocol on an asyncio event loop, Python 3 only. The packets
+# on the wire are the ones sock352.Socket sends, so the other side can be
+# the blocking library, but there are no threads here: a connection is an
+# asyncio transport that runs on the datagrams its UDP endpoint receives
+# and on timers armed with loop.call_at. All the connections of a server
+# share its one UDP socket, so one event loop can drive thousands of them.
+#
+# open_connection() and start_server() work like the asyncio functions of
+# the same name and hand out asyncio StreamReader/StreamWriter objects.
+# create_connection() and create_server() take a protocol factory like the
+# loop methods do.
+#
+# Each write() goes out as one message: with segmentation the packets of a
+# long one carry MORE, so a blocking peer gets it from one recvfrom. The
+# other way data_received() is called once per message, an empty one is
+# not passed on. Selective repeat, flow control, segmentation and answers
+# to path MTU probes are offered in the SYN. This side does not probe the
+# path MTU itself.
+#
+# Retransmission, SACK, delayed ACKs and the windows are sock352.ProtocolCore,
+# the same code the blocking Socket runs.
+
+import asyncio
+import collections
+import contextlib
+import socket as ip
+
+import sock352
+from sock352 import (Packet, skbuf, ProtocolCore, SYN, ACK, DATA, FIN,
+                     PROBE, MORE, HEADER_LEN, MAX_SIZE, DEFAULT_MSS,
+                     DEFAULT_WINDOW, RECV_BUFFER, ACK_EVERY, DELACK_TIMEOUT,
+                     DUPACK_THRESHOLD, RTO_MAX, REORDER_LIMIT,
+                     CLOSE_LINGER_RTOS, RECV_BATCH_BUFFER,
+                     OPT_SYN_OFFER,
+                     OPT_SYN_ACCEPT, OPT_RWND, OPT_PMTU, FEATURE_SACK,
+                     FEATURE_RWND, FEATURE_SEGMENT, FEATURE_PMTU,
+                     FEATURE_STRUCT, WINDOW_STRUCT, PMTU_STRUCT,
+                     packet_features)
+
+# the sequence numbers the blocking library starts from
+CLIENT_ISN = 0x8ecb
+SERVER_ISN = 0x2be6
+
+# a SYN is sent this many times, RTO apart with backoff, before connecting
+# gives up
+CONNECT_TRIES = 6
+
+# a server forgets a connection whose handshake did not finish in this many
+# seconds. Every connection is handed to its protocol as soon as the
+# handshake is over, so there is no accept queue, the backlog is the most
+# handshakes going on at once
+HANDSHAKE_TIMEOUT = 30.0
+SYN_BACKLOG = 1024
+
+# default buffer limit of the StreamReader of open_connection/start_server
+STREAM_LIMIT = 64 * 1024
+
+# unsent data above this pauses the writer (drain() waits), the default
+# low water mark is a quarter of it
+WRITE_HIGH_WATER = 64 * 1024
+
+
+# one UDP socket and the connections on it, by peer address. A server
+# endpoint also starts connections for SYNs from new addresses.
+class Endpoint(asyncio.DatagramProtocol):
+    def __init__(self, loop, server=None):
+        self.loop = loop
+        self.server = server
+        self.transport = None
+        self.connections = {}
+        self.closed = loop.create_future()
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, address):
+        if (len(data) < HEADER_LEN):
+            return
+        packet = Packet()
+        packet.unpack(data)
+        conn = self.connections.get(address)
+        if (conn != None):
+            conn.packetreceived(packet)
+        elif (self.server != None) and ((packet.cntl & (SYN | ACK)) == SYN):
+            self.server.newconnection(self, packet, address)
+
+    # ICMP errors, a port that is not open yet shows up here. A client still
+    # sending SYNs keeps trying, the rest is left to retransmission
+    def error_received(self, exc):
+        pass
+
+    def connection_lost(self, exc):
+        for conn in list(self.connections.values()):
+            conn.abort()
+        if (not self.closed.done()):
+            self.closed.set_result(None)
+
+    def sendto(self, packet, address):
+        self.transport.sendto(packet.pack(), address)
+
+    # a connection is done with, a client endpoint closes with its only
+    # connection and a server's once it stopped listening and is empty
+    def remove(self, conn):
+        if (self.connections.get(conn.address) is conn):
+            del self.connections[conn.address]
+        if (len(self.connections) == 0) and ((self.server == None) or (not self.server.listening)):
+            self.transport.close()
+
+
+# a timer of a connection on the event loop. Like a sock352.Timer it is
+# passed to its callback, which can tell from it whether it is still the
+# timer it armed.
+class LoopTimer(object):
+    __slots__ = ('when', 'handle')
+
+    def __init__(self, when):
+        self.when = when
+        self.handle = None
+
+
+# one sock352 connection as an asyncio transport. The protocol itself is
+# sock352.ProtocolCore, the one the blocking Socket runs, driven here by
+# the datagrams of the endpoint and by loop timers.
+class Connection(ProtocolCore, asyncio.Transport):
+    def __init__(self, loop, endpoint, address, congestion_control='newreno',
+                 flow_control=True, recv_buffer=RECV_BUFFER, mss=DEFAULT_MSS,
+                 window=DEFAULT_WINDOW, selective_repeat=True,
+                 ack_every=ACK_EVERY, delack_timeout=DELACK_TIMEOUT,
+                 dupack_threshold=DUPACK_THRESHOLD):
+        asyncio.Transport.__init__(self)
+        # the loop runs everything on one thread, there is nothing to lock
+        ProtocolCore.__init__(self, contextlib.nullcontext())
+        if (congestion_control not in sock352.congestion_controls):
+            raise ValueError("sock352: unknown congestion control %s" % (congestion_control))
+        if (mss <= 0) or (mss > MAX_SIZE):
+            raise ValueError("sock352: mss must be between 1 and %d" % (MAX_SIZE))
+        self.loop = loop
+        self.endpoint = endpoint
+        self.address = address
+        self.protocol = None
+        sock = endpoint.transport.get_extra_info('socket')
+        self._extra['peername'] = address
+        self._extra['sockname'] = endpoint.transport.get_extra_info('sockname')
+        self._extra['socket'] = sock
+        # handshaking until the SYN exchange is over, established after it,
+        # closing once close() was called and done when both FINs are ACKed
+        self.client = False
+        self.handshaking = False
+        self.established = False
+        self.closing = False
+        self.done = False
+        self.waiter = None
+        self.handshaketimer = None
+        self.syntries = 0
+        self.syntime = 0.0
+        self.synack = None
+        # send side: messages cut into (data, cntl) packets not sent yet and
+        # their bytes
+        self.sendqueue = collections.deque()
+        self.sendqueuebytes = 0
+        self.finseq = None
+        self.finacked = False
+        self.cc = sock352.congestion_controls[congestion_control]()
+        self.windowpackets = window
+        self.set_delayed_ack(ack_every, delack_timeout)
+        self.set_dupack_threshold(dupack_threshold)
+        # features, what we offer until the SYN exchange settles them
+        self.selectiverepeat = selective_repeat
+        self.flowcontrol = flow_control
+        self.segmentation = True
+        self.pmtuecho = True
+        self.mss = mss
+        self.recvbuffer = recv_buffer
+        self.rwndsent = recv_buffer
+        # receive side: messages the protocol has not been given yet while it
+        # paused reading, and their bytes, which count against recvbuffer.
+        # remoteclosed once the FIN came in, eofdelivered once the protocol
+        # was told after the last of the data.
+        self.reading = True
+        self.recvqueue = collections.deque()
+        self.recvqueuebytes = 0
+        self.partial = None
+        self.remoteclosed = False
+        self.eofdelivered = False
+        self.writing = True
+        self.highwater = WRITE_HIGH_WATER
+        self.lowwater = WRITE_HIGH_WATER // 4
+
+    # what ProtocolCore needs: the clock and timers of the loop and the
+    # endpoint's UDP socket
+    def now(self):
+        return self.loop.time()
+
+    def settimer(self, when, func):
+        timer = LoopTimer(when)
+        timer.handle = self.loop.call_at(when, func, timer)
+        return timer
+
+    def canceltimer(self, timer):
+        timer.handle.cancel()
+
+    def sendpacket(self, packet):
+        self.endpoint.sendto(packet, self.address)
+
+    def resendpackets(self, packets):
+        for packet in packets:
+            self.endpoint.sendto(packet, self.address)
+
+    def giveup(self, error):
+        self.abort(error)
+
+    # the free bytes of our receive buffer, what is queued while the
+    # protocol paused reading takes up some of it
+    def recvwindow(self):
+        return max(self.recvbuffer - self.recvqueuebytes, 0)
+
+    # the feature bits this side offers in the SYN exchange
+    def features(self):
+        bits = FEATURE_SEGMENT | FEATURE_PMTU
+        if (self.selectiverepeat):
+            bits |= FEATURE_SACK
+        if (self.flowcontrol):
+            bits |= FEATURE_RWND
+        return bits
+
+    def setfeatures(self, bits):
+        self.selectiverepeat = ((bits & FEATURE_SACK) != 0)
+        self.flowcontrol = ((bits & FEATURE_RWND) != 0)
+        self.segmentation = ((bits & FEATURE_SEGMENT) != 0)
+        self.pmtuecho = ((bits & FEATURE_PMTU) != 0)
+
+    def synoptions(self, kind):
+        options = {kind: FEATURE_STRUCT.pack(self.features())}
+        if (self.flowcontrol):
+            options[OPT_RWND] = WINDOW_STRUCT.pack(self.recvwindow())
+        return options
+
+    # client: send the SYN and wait until the SYN ACK makes protocol the
+    # protocol of the connection
+    async def connect(self, protocol):
+        self.protocol = protocol
+        self.client = True
+        self.handshaking = True
+        self.mySequenceNumber = CLIENT_ISN
+        self.waiter = self.loop.create_future()
+        self.sendsyn()
+        try:
+            await self.waiter
+        finally:
+            self.waiter = None
+            if (self.handshaketimer != None):
+                self.handshaketimer.cancel()
+                self.handshaketimer = None
+
+    def sendsyn(self):
+        packet = Packet()
+        packet.cntl = SYN
+        packet.seq = CLIENT_ISN
+        packet.options = self.synoptions(OPT_SYN_OFFER)
+        self.syntime = self.loop.time()
+        self.syntries += 1
+        self.endpoint.sendto(packet, self.address)
+        self.handshaketimer = self.loop.call_at(self.syntime + self.rto, self.synexpired)
+
+    def synexpired(self):
+        self.handshaketimer = None
+        if (self.syntries >= CONNECT_TRIES):
+            self.waiter.set_exception(TimeoutError("sock352: no answer from %s:%d" % self.address))
+            return
+        self.backoff += 1
+        self.rto = min(self.rto * 2, RTO_MAX)
+        self.sendsyn()
+
+    # client: the SYN ACK came in, agree on the features and ACK it the way
+    # the blocking library does, with the SYN ACK sent back
+    def handlesynack(self, packet):
+        self.otherSequenceNumber = packet.seq
+        # a resent SYN gives no RTT sample, the RTO stays backed off but the
+        # lost SYNs do not count towards giving up on the connection
+        if (self.syntries == 1):
+            self.updatertt(self.loop.time() - self.syntime)
+        self.backoff = 0
+        self.setfeatures(self.features() & packet_features(packet, OPT_SYN_ACCEPT))
+        self.handlewindow(packet)
+        self.synack = Packet()
+        self.synack.cntl = SYN | ACK
+        self.synack.ack = packet.seq
+        self.endpoint.sendto(self.synack, self.address)
+        self.lastack = self.mySequenceNumber
+        self.handshaking = False
+        self.established = True
+        self.protocol.connection_made(self)
+        if (not self.waiter.done()):
+            self.waiter.set_result(None)
+
+    # server: answer a SYN from the address of this connection
+    def handlesyn(self, packet):
+        self.handshaking = True
+        self.otherSequenceNumber = packet.seq
+        self.mySequenceNumber = SERVER_ISN
+        offered = (packet.options != None) and (OPT_SYN_OFFER in packet.options)
+        self.setfeatures(self.features() & packet_features(packet, OPT_SYN_OFFER))
+        self.handlewindow(packet)
+        self.synack = Packet()
+        self.synack.cntl = SYN | ACK
+        self.synack.seq = SERVER_ISN
+        self.synack.ack = packet.seq
+        if (offered):
+            self.synack.options = self.synoptions(OPT_SYN_ACCEPT)
+        self.syntime = self.loop.time()
+        self.syntries = 1
+        self.endpoint.sendto(self.synack, self.address)
+        self.handshaketimer = self.loop.call_later(HANDSHAKE_TIMEOUT, self.abort)
+
+    # server: the client ACKed our SYN ACK, the connection is open
+    def handshakedone(self, protocol):
+        self.handshaketimer.cancel()
+        self.handshaketimer = None
+        if (self.syntries == 1):
+            self.updatertt(self.loop.time() - self.syntime)
+        self.lastack = self.mySequenceNumber
+        self.handshaking = False
+        self.established = True
+        self.protocol = protocol
+        protocol.connection_made(self)
+
+    def packetreceived(self, packet):
+        self.counters['packets_received'] += 1
+        if (packet.cntl & SYN):
+            self.handlesynpacket(packet)
+            return
+        if (self.handshaking):
+            if (self.client):
+                return
+            self.endpoint.server.established(self)
+        if (packet.options != None) and (OPT_PMTU in packet.options):
+            self.handlepmtu(packet)
+            return
+        self.handlewindow(packet)
+        if (packet.cntl & ACK) and (len(self.outstanding) != 0):
+            self.handleack(packet)
+        expectedseq = self.otherSequenceNumber
+        if (packet.cntl & PROBE):
+            self.ackqueue.append(expectedseq)
+        elif (packet.seq == expectedseq + 1):
+            if (self.deliver(packet)):
+                if (len(self.reorder) > 0):
+                    # packets held in the reorder buffer may follow on from
+                    # this one, the sender wants to hear at once that the
+                    # hole is filled
+                    while ((self.otherSequenceNumber + 1) in self.reorder):
+                        self.deliver(self.reorder.pop(self.otherSequenceNumber + 1))
+                    self.ackqueue.append(self.otherSequenceNumber)
+                elif (not self.remoteclosed):
+                    self.delayack()
+        elif (packet.seq != 0) and (packet.seq <= expectedseq):
+            # the ACK of this one was lost
+            self.ackqueue.append(packet.seq)
+        elif (packet.seq > expectedseq + 1):
+            # a packet before this one was lost, repeat the cumulative ACK.
+            # Go back N drops this packet, selective repeat keeps it until
+            # the hole is filled
+            self.ackqueue.append(expectedseq)
+            if (self.selectiverepeat) and (packet.seq <= expectedseq + REORDER_LIMIT):
+                self.reorder[packet.seq] = packet
+        self.sendacks()
+        self.push()
+
+    # a packet with SYN set. A client gets the SYN ACK, or a copy of it when
+    # the server did not get our ACK. A server gets the SYN again when its
+    # SYN ACK was lost, or the client's ACK, which ends the handshake.
+    def handlesynpacket(self, packet):
+        if (self.client):
+            if (not self.handshaking):
+                self.endpoint.sendto(self.synack, self.address)
+            elif (packet.cntl & ACK) and (packet.ack == CLIENT_ISN):
+                self.handlesynack(packet)
+        elif (self.handshaking):
+            if (packet.cntl & ACK):
+                self.endpoint.server.established(self)
+            else:
+                self.syntries += 1
+                self.endpoint.sendto(self.synack, self.address)
+
+    # a path MTU probe of the other side is answered with its size
+    def handlepmtu(self, packet):
+        value = packet.options[OPT_PMTU]
+        if (not (packet.cntl & PROBE)) or (len(value) < PMTU_STRUCT.size):
+            return
+        answer = Packet()
+        answer.cntl = ACK
+        answer.ack = self.otherSequenceNumber
+        answer.options = {OPT_PMTU: value}
+        self.endpoint.sendto(answer, self.address)
+
+    # the next packet in sequence, its data is queued for the protocol. With
+    # the reader paused and no flow control to hold the sender back, data
+    # past the receive buffer is dropped for the sender to resend later.
+    # Returns whether the packet was taken.
+    def deliver(self, packet):
+        if (packet.cntl & FIN):
+            self.otherSequenceNumber += 1
+            self.remoteclosed = True
+            self.ackqueue.append(self.otherSequenceNumber)
+            self.sendacks()
+            self.feed()
+            return True
+        if (not self.reading) and (not self.flowcontrol) and (self.recvqueuebytes >= self.recvbuffer):
+            self.counters['dropped'] += 1
+            return False
+        self.otherSequenceNumber += 1
+        if (self.done):
+            return True
+        data = packet.data
+        # the segments of a message are put back together first
+        if (packet.cntl & MORE) or (self.partial != None):
+            if (self.partial == None):
+                self.partial = []
+            self.partial.append(data)
+            if (packet.cntl & MORE):
+                return True
+            data = b''.join(self.partial)
+            self.partial = None
+        if (len(data) > 0):
+            self.recvqueue.append(data)
+            self.recvqueuebytes += len(data)
+            self.feed()
+        return True
+
+    # hand the queued messages to the protocol while it reads, and once the
+    # other side closed and they are all out, the end of the data
+    def feed(self):
+        while (self.reading) and (len(self.recvqueue) > 0) and (not self.done):
+            data = self.recvqueue.popleft()
+            self.recvqueuebytes -= len(data)
+            self.protocol.data_received(data)
+        if (self.remoteclosed) and (not self.eofdelivered) and (len(self.recvqueue) == 0) and (not self.done):
+            self.eofdelivered = True
+            if (not self.protocol.eof_received()):
+                self.close()
+            self.checkdone()
+
+    # send queued packets while the window has room
+    def push(self):
+        queue = self.sendqueue
+        sent = False
+        while (len(queue) > 0) and (not self.windowfull(len(queue[0][0]))):
+            (data, cntl) = queue.popleft()
+            self.sendqueuebytes -= len(data)
+            packet = Packet()
+            packet.cntl = cntl
+            packet.data = data
+            packet.size = len(data)
+            self.mySequenceNumber += 1
+            packet.seq = self.mySequenceNumber
+            if (cntl & FIN):
+                self.finseq = packet.seq
+            self.piggyback(packet)
+            self.outstanding.append(skbuf(packet, self.now()))
+            self.inflightbytes += packet.size
+            self.endpoint.sendto(packet, self.address)
+            self.counters['packets_sent'] += 1
+            sent = True
+        if (sent) and (self.rtxdue == 0):
+            self.starttimer()
+        if (not self.writing) and (self.sendqueuebytes <= self.lowwater):
+            self.writing = True
+            self.protocol.resume_writing()
+
+    # our FIN was ACKed, see checkdone
+    def retire(self, ack):
+        ProtocolCore.retire(self, ack)
+        if (self.finseq != None) and (ack >= self.finseq) and (not self.finacked):
+            self.finacked = True
+            self.checkdone()
+
+    # both sides sent a FIN, ours was ACKed and the protocol got the end of
+    # the data. The connection stays with the endpoint a few RTOs more, to
+    # ACK the FIN again if it is resent
+    def checkdone(self):
+        if (self.done) or (not self.finacked) or (not self.eofdelivered):
+            return
+        self.finish()
+        self.loop.call_later(CLOSE_LINGER_RTOS * self.rto, self.endpoint.remove, self)
+        self.protocol.connection_lost(None)
+
+    def finish(self):
+        self.done = True
+        self.closing = True
+        self.sendqueue.clear()
+        self.sendqueuebytes = 0
+        self.rtxqueue.clear()
+        self.recvqueue.clear()
+        self.recvqueuebytes = 0
+        self.reorder.clear()
+        self.stoptimer()
+        self.stopdelack()
+        self.stopprobe()
+        if (self.handshaketimer != None):
+            self.handshaketimer.cancel()
+            self.handshaketimer = None
+
+    # asyncio.Transport
+
+    # send data as one message, cut into packets of up to mss bytes
+    def write(self, data):
+        if (self.closing):
+            return
+        data = bytes(data)
+        size = len(data)
+        if (self.segmentation):
+            chunk = self.mss
+            more = MORE
+        else:
+            # a peer that cannot reassemble gets up to MAX_SIZE per packet
+            chunk = MAX_SIZE
+            more = 0
+        offset = 0
+        while (offset + chunk < size):
+            self.sendqueue.append((data[offset:offset + chunk], DATA | more))
+            offset += chunk
+        self.sendqueue.append((data[offset:], DATA))
+        self.sendqueuebytes += size
+        self.push()
+        if (self.writing) and (self.sendqueuebytes > self.highwater):
+            self.writing = False
+            self.protocol.pause_writing()
+
+    def can_write_eof(self):
+        return False
+
+    # send the FIN once the data queued before it is out, the connection
+    # ends when the other side closed as well
+    def close(self):
+        if (self.closing):
+            return
+        self.closing = True
+        self.sendqueue.append((b'', FIN))
+        self.push()
+
+    def is_closing(self):
+        return self.closing
+
+    # drop the connection without a FIN
+    def abort(self, exc=None):
+        if (self.done):
+            return
+        if (self.handshaking) and (not self.client):
+            self.endpoint.server.handshakes -= 1
+        self.finish()
+        self.endpoint.remove(self)
+        if (self.waiter != None) and (not self.waiter.done()):
+            self.waiter.set_exception(exc or ConnectionAbortedError("sock352: connection aborted"))
+        elif (self.established):
+            self.protocol.connection_lost(exc)
+
+    def get_write_buffer_size(self):
+        return self.sendqueuebytes
+
+    def get_write_buffer_limits(self):
+        return (self.lowwater, self.highwater)
+
+    def set_write_buffer_limits(self, high=None, low=None):
+        if (high == None):
+            if (low == None):
+                high = WRITE_HIGH_WATER
+            else:
+                high = 4 * low
+        if (low == None):
+            low = high // 4
+        if (not (high >= low >= 0)):
+            raise ValueError("sock352: high (%r) must be >= low (%r) must be >= 0" % (high, low))
+        self.highwater = high
+        self.lowwater = low
+
+    # reading is paused when the StreamReader holds too much, what arrives
+    # meanwhile is queued and the window we advertise closes as it fills
+    def pause_reading(self):
+        self.reading = False
+
+    # hand out what was queued, then tell a sender waiting on a small window
+    # that it opened up again
+    def resume_reading(self):
+        if (self.reading):
+            return
+        self.reading = True
+        self.feed()
+        if (self.flowcontrol) and (not self.done) and (self.rwndsent < self.recvbuffer // 2) and (self.recvwindow() >= self.recvbuffer // 2):
+            self.counters['window_updates'] += 1
+            self.ackqueue.append(self.otherSequenceNumber)
+            self.sendacks()
+
+    def is_reading(self):
+        return self.reading
+
+    def set_protocol(self, protocol):
+        self.protocol = protocol
+
+    def get_protocol(self):
+        return self.protocol
+
+    # RTT estimate, timeout and counters of this connection
+    def get_stats(self):
+        stats = dict(self.counters)
+        stats['srtt'] = self.srtt
+        stats['rttvar'] = self.rttvar
+        stats['rto'] = self.rto
+        stats['backoff'] = self.backoff
+        stats['inflight'] = len(self.outstanding)
+        stats['inflight_bytes'] = self.inflightbytes
+        stats['unsent_bytes'] = self.sendqueuebytes
+        stats['congestion_control'] = self.cc.name
+        stats['cwnd'] = self.cc.cwnd
+        stats['ssthresh'] = self.cc.ssthresh
+        stats['selective_repeat'] = self.selectiverepeat
+        stats['reorder'] = len(self.reorder)
+        stats['flow_control'] = self.flowcontrol
+        stats['recv_window'] = self.recvwindow()
+        stats['peer_window'] = self.peerwindow
+        stats['mss'] = self.mss
+        stats['segmentation'] = self.segmentation
+        return stats
+
+
+# the listening side, what create_server and start_server return. Like an
+# asyncio Server, close() stops new connections and leaves the ones open
+# alone, the UDP socket is closed after the last of them.
+class Server(object):
+    def __init__(self, loop, protocolfactory, backlog, options):
+        self.loop = loop
+        self.protocolfactory = protocolfactory
+        self.backlog = backlog
+        self.options = options
+        self.endpoint = None
+        self.listening = True
+        self.handshakes = 0
+        self.serving = None
+        self.counters = {'accepted': 0, 'listen_drops': 0}
+
+    @property
+    def sockets(self):
+        if (self.endpoint == None) or (self.endpoint.transport.is_closing()):
+            return ()
+        return (self.endpoint.transport.get_extra_info('socket'),)
+
+    # a SYN from a new address, answer it unless backlog handshakes are
+    # going on already
+    def newconnection(self, endpoint, packet, address):
+        if (not self.listening) or (self.handshakes >= self.backlog):
+            self.counters['listen_drops'] += 1
+            return
+        conn = Connection(self.loop, endpoint, address, **self.options)
+        endpoint.connections[address] = conn
+        self.handshakes += 1
+        conn.handlesyn(packet)
+
+    # the handshake of conn is over, give it a protocol
+    def established(self, conn):
+        self.handshakes -= 1
+        self.counters['accepted'] += 1
+        conn.handshakedone(self.protocolfactory())
+
+    def is_serving(self):
+        return self.listening
+
+    def close(self):
+        if (not self.listening):
+            return
+        self.listening = False
+        for conn in list(self.endpoint.connections.values()):
+            if (conn.handshaking):
+                conn.abort()
+        if (len(self.endpoint.connections) == 0):
+            self.endpoint.transport.close()
+        if (self.serving != None) and (not self.serving.done()):
+            self.serving.set_result(None)
+
+    async def wait_closed(self):
+        await asyncio.shield(self.endpoint.closed)
+
+    async def start_serving(self):
+        pass
+
+    async def serve_forever(self):
+        self.serving = self.loop.create_future()
+        try:
+            await self.serving
+        finally:
+            self.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        self.close()
+        await self.wait_closed()
+
+    # the counters of the open connections added up, plus the server's own
+    def get_stats(self):
+        stats = dict(self.counters)
+        stats['connections'] = len(self.endpoint.connections)
+        for conn in self.endpoint.connections.values():
+            for (name, value) in conn.counters.items():
+                stats[name] = stats.get(name, 0) + value
+        return stats
+
+
+async def resolve(loop, host, port):
+    infos = await loop.getaddrinfo(host, port, family=ip.AF_INET, type=ip.SOCK_DGRAM)
+    if (len(infos) == 0):
+        raise OSError("sock352: cannot resolve %s" % (host))
+    return infos[0][4]
+
+# connect to a sock352 server at host, port. Returns (transport, protocol)
+# like loop.create_connection. The keywords set up the connection: the
+# congestion_control by name, selective_repeat, flow_control, recv_buffer,
+# mss, window (in packets), ack_every and delack_timeout (see
+# set_delayed_ack) and dupack_threshold.
+async def create_connection(protocol_factory, host, port, local_addr=None, **options):
+    loop = asyncio.get_running_loop()
+    address = await resolve(loop, host, port)
+    if (local_addr == None):
+        local_addr = ('0.0.0.0', 0)
+    (transport, endpoint) = await loop.create_datagram_endpoint(
+        lambda: Endpoint(loop), local_addr=local_addr, family=ip.AF_INET)
+    try:
+        conn = Connection(loop, endpoint, address, **options)
+        endpoint.connections[address] = conn
+        protocol = protocol_factory()
+        await conn.connect(protocol)
+    except:
+        transport.close()
+        raise
+    return (conn, protocol)
+
+# serve sock352 connections on host, port, every one gets a protocol from
+# protocol_factory. The keywords are the ones of create_connection.
+async def create_server(protocol_factory, host=None, port=0, backlog=SYN_BACKLOG, **options):
+    loop = asyncio.get_running_loop()
+    if (host == None):
+        host = '0.0.0.0'
+    server = Server(loop, protocol_factory, backlog, options)
+    (transport, endpoint) = await loop.create_datagram_endpoint(
+        lambda: Endpoint(loop, server), local_addr=(host, port), family=ip.AF_INET)
+    # the peers' packets arrive in bursts that the loop reads one datagram
+    # at a time, the kernel has to hold them until then (capped at
+    # net.core.rmem_max)
+    sock = transport.get_extra_info('socket')
+    if (sock.getsockopt(ip.SOL_SOCKET, ip.SO_RCVBUF) < RECV_BATCH_BUFFER):
+        sock.setsockopt(ip.SOL_SOCKET, ip.SO_RCVBUF, RECV_BATCH_BUFFER)
+    server.endpoint = endpoint
+    return server
+
+async def open_connection(host, port, limit=STREAM_LIMIT, **kwds):
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader(limit=limit, loop=loop)
+    protocol = asyncio.StreamReaderProtocol(reader, loop=loop)
+    (transport, ignored) = await create_connection(lambda: protocol, host, port, **kwds)
+    writer = asyncio.StreamWriter(transport, protocol, reader, loop)
+    return (reader, writer)
+
+# client_connected_cb(reader, writer) is called for every new connection,
+# a coroutine function runs as a task
+async def start_server(client_connected_cb, host=None, port=0, limit=STREAM_LIMIT, **kwds):
+    loop = asyncio.get_running_loop()
+
+    def factory():
+        reader = asyncio.StreamReader(limit=limit, loop=loop)
+        return asyncio.StreamReaderProtocol(reader, client_connected_cb, loop=loop)
+
+    return await create_server(factory, host, port, **kwds)
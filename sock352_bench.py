@@ -0,0 +1,390 @@
+#!/usr/bin/python
+
+# micro benchmarks for the sock352 library
+# these time single pieces of the packet path in a tight loop and print
+# packets/sec, so changes to the library can be compared before and after
+
+import argparse
+import multiprocessing
+import threading
+import time
+import socket as ip
+import struct as st
+import sock352
+
+
+# the original codec, kept here as the "before" numbers: a new format string
+# is built and parsed by struct for every packet
+def legacy_pack(packet):
+    data_len = len(packet.data)
+    new_format = sock352.HEADER_FMT + str(data_len) + 's'
+    return st.pack(new_format,packet.type,packet.cntl,packet.seq,packet.ack,packet.size,packet.data)
+
+def legacy_unpack(packet,bytes):
+    data_len = (len(bytes) - st.calcsize('!bbLLH'))
+    new_format = sock352.HEADER_FMT + str(data_len) + 's'
+    values = st.unpack(new_format,bytes)
+    packet.type = values[0]
+    packet.cntl = values[1]
+    packet.seq  = values[2]
+    packet.ack  = values[3]
+    packet.size = values[4]
+    packet.data = values[5]
+
+# run func count times and return the packets/sec
+def rate(func,count):
+    start = time.time()
+    func(count)
+    lapsed = time.time() - start
+    return float(count) / lapsed
+
+def report(name,before,after):
+    print("%-24s before %12.0f pkts/sec  after %12.0f pkts/sec  (%.2fx)" % (name,before,after,after/before))
+
+def bench_codec(count,payload_size):
+    packet = sock352.Packet()
+    packet.cntl = sock352.DATA
+    packet.seq = 1
+    packet.data = b'x' * payload_size
+    packet.size = payload_size
+    wire = packet.pack()
+    view = memoryview(wire)
+    buffer = memoryview(bytearray(sock352.MAX_PKT))
+    pack_into = sock352.pack_packet_into
+
+    def old_pack(n):
+        for i in range(n):
+            legacy_pack(packet)
+
+    def new_pack(n):
+        for i in range(n):
+            pack_into(buffer,0,packet.type,packet.cntl,packet.seq,packet.ack,packet.size,packet.data)
+
+    def old_unpack(n):
+        p = sock352.Packet()
+        for i in range(n):
+            legacy_unpack(p,wire)
+
+    def new_unpack(n):
+        unpack_from = sock352.unpack_packet_from
+        for i in range(n):
+            unpack_from(view)
+
+    report("pack %d bytes" % payload_size, rate(old_pack,count), rate(new_pack,count))
+    report("unpack %d bytes" % payload_size, rate(old_unpack,count), rate(new_unpack,count))
+
+# datagrams are sent in batches that fit in the socket buffer, then read back,
+# only the receive side is timed. Each read returns how many packets it got
+def bench_recv(count,payload_size):
+    batch = 64
+    receiver = sock352.Socket()
+    receiver.mysocket.setsockopt(ip.SOL_SOCKET, ip.SO_RCVBUF, 4*1024*1024)
+    receiver.bind(('127.0.0.1',0))
+    address = receiver.mysocket.getsockname()
+    sender = ip.socket(ip.AF_INET,ip.SOCK_DGRAM)
+
+    packet = sock352.Packet()
+    packet.cntl = sock352.DATA
+    packet.data = b'x' * payload_size
+    packet.size = payload_size
+    wire = packet.pack()
+    buffer = memoryview(bytearray(payload_size))
+
+    def timed(read,n):
+        lapsed = 0.0
+        done = 0
+        while (done < n):
+            for i in range(batch):
+                sender.sendto(wire,address)
+            start = time.time()
+            got = 0
+            while (got < batch):
+                got = got + read()
+            lapsed = lapsed + (time.time() - start)
+            done = done + batch
+        return float(done) / lapsed
+
+    # the old path: a new MAX_SIZE string per datagram plus a copy in unpack
+    def old_read():
+        p = sock352.Packet()
+        legacy_unpack(p,receiver.mysocket.recvfrom(sock352.MAX_SIZE)[0])
+        return 1
+
+    # the ring path, payload left in place as a view (recvfrom_view)
+    def view_read():
+        (slot, p) = receiver.recvpacket()
+        receiver.recvring.release(slot)
+        return 1
+
+    # the ring path plus one copy into the application buffer (recv_into)
+    def copy_read():
+        (slot, p) = receiver.recvpacket()
+        buffer[:len(p.data)] = p.data
+        receiver.recvring.release(slot)
+        return 1
+
+    # the ring path with recvmmsg, every datagram waiting per system call
+    def batch_read():
+        packets = receiver.recvpackets()
+        for (slot, p) in packets:
+            receiver.recvring.release(slot)
+        return len(packets)
+
+    before = timed(old_read,count)
+    single = timed(view_read,count)
+    report("recv view %d bytes" % payload_size, before, single)
+    report("recv_into %d bytes" % payload_size, before, timed(copy_read,count))
+    receiver.set_batched_recv()
+    if (receiver.get_stats()['batch_recv'] == None):
+        print("no recvmmsg here, batched receive is off")
+        return
+    calls = receiver.get_stats()['recv_calls']
+    batched = timed(batch_read,count)
+    calls = receiver.get_stats()['recv_calls'] - calls
+    # against one datagram per system call on the same ring
+    report("recv batched %d bytes" % payload_size, single, batched)
+    print("%-24s before %12.1f pkts/call  after %12.1f pkts/call" % ("recv system calls",1.0,float(count)/calls))
+
+# the original Packet and skbuf layout, a plain class with a dictionary per object
+class LegacyPacket:
+    def __init__(self):
+        self.type = sock352.MESSAGE_TYPE
+        self.cntl = 0
+        self.seq = 0
+        self.ack = 0
+        self.size = 0
+        self.data = b''
+
+class LegacySkbuf:
+    def __init__(self, Packet, time_sent):
+        self.Packet = Packet
+        self.time_sent = time_sent
+
+# bytes of Python heap needed to hold count queued packets plus their skbufs
+def queue_memory(newpacket,newskbuf,count):
+    try:
+        import tracemalloc
+    except ImportError:
+        return 0
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    queue = []
+    for i in range(count):
+        p = newpacket()
+        p.seq = i
+        queue.append(newskbuf(p,0.0))
+    used = tracemalloc.get_traced_memory()[0] - base
+    tracemalloc.stop()
+    return used
+
+def bench_pool(count):
+    # allocation cost of a send/ACK cycle, without and with the pool
+    def old_cycle(n):
+        for i in range(n):
+            p = LegacyPacket()
+            b = LegacySkbuf(p,0.0)
+
+    def slots_cycle(n):
+        for i in range(n):
+            p = sock352.Packet()
+            b = sock352.skbuf(p,0.0)
+
+    s = sock352.Socket()
+    s.set_packet_pool()
+    def pool_cycle(n):
+        for i in range(n):
+            p = s.newpacket()
+            b = s.newskbuf(p,0.0)
+            s.freeskbuf(b)
+
+    before = rate(old_cycle,count)
+    report("packet+skbuf alloc", before, rate(slots_cycle,count))
+    report("packet+skbuf pooled", before, rate(pool_cycle,count))
+    print("pool stats %s" % (s.get_pool_stats()))
+
+    before = queue_memory(LegacyPacket,LegacySkbuf,count)
+    after = queue_memory(sock352.Packet,sock352.skbuf,count)
+    if (before > 0):
+        print("%-24s before %12.1f bytes/pkt   after %12.1f bytes/pkt" % ("queued packet memory",float(before)/count,float(after)/count))
+
+# retire a full window of packets one ACK at a time. The old way only
+# scanned the lists. The new way also updates the RTT, cwnd and the timer on
+# every ACK, so it loses on small windows (see ProtocolCore.retire).
+def bench_ack(window):
+    rounds = 20
+
+    # the old retirement: a scan of both queues for every ACK
+    def old_retire(n):
+        for r in range(rounds):
+            transmitqueue = []
+            outstanding = []
+            for seq in range(1,window+1):
+                p = sock352.Packet()
+                p.seq = seq
+                transmitqueue.append(p)
+                outstanding.append(sock352.skbuf(p,0.0))
+            for ack in range(1,window+1):
+                for i in range(len(transmitqueue)):
+                    if transmitqueue[i].seq == ack:
+                        transmitqueue.remove(transmitqueue[i])
+                        break
+                for i in outstanding:
+                    if (i.Packet.seq == ack):
+                        outstanding.remove(i)
+
+    # retire is called with the lock held, handleack takes it once per ACK
+    s = sock352.Socket()
+    def new_retire(n):
+        for r in range(rounds):
+            for seq in range(1,window+1):
+                p = sock352.Packet()
+                p.seq = seq
+                s.outstanding.append(sock352.skbuf(p,0.0))
+            for ack in range(1,window+1):
+                with s.lock:
+                    s.retire(ack)
+
+    report("ACK window %d" % window, rate(old_retire,window*rounds), rate(new_retire,window*rounds))
+
+# the receiving end of the send benchmark, in its own process so it can ACK
+def send_receiver(port,total):
+    s = sock352.Socket()
+    s.bind(('127.0.0.1',port))
+    s.accept()
+    received = 0
+    while (received < total):
+        received = received + len(s.recvfrom(sock352.MAX_SIZE))
+    s.close()
+
+# a loopback transfer of count packets, one packet per system call and then
+# batched. Returns packets/sec, send system calls and the batch mode.
+def send_transfer(count,payload_size,batched):
+    free = ip.socket(ip.AF_INET,ip.SOCK_DGRAM)
+    free.bind(('127.0.0.1',0))
+    port = free.getsockname()[1]
+    free.close()
+    receiver = multiprocessing.Process(target=send_receiver, args=(port,count*payload_size))
+    receiver.start()
+    time.sleep(0.3)
+
+    s = sock352.Socket()
+    s.bind(('127.0.0.1',0))
+    s.set_mss(payload_size)
+    if (batched):
+        s.set_batched_send()
+    s.connect(('127.0.0.1',port))
+    data = b'x' * (count*payload_size)
+    start = time.time()
+    s.sendall(data)
+    s.close()
+    lapsed = time.time() - start
+    receiver.join()
+    stats = s.get_stats()
+    return (float(count) / lapsed, stats['send_calls'], stats['batch_send'])
+
+def bench_send(count,payload_size):
+    (before, beforecalls, mode) = send_transfer(count,payload_size,False)
+    (after, aftercalls, mode) = send_transfer(count,payload_size,True)
+    report("send %d bytes" % payload_size, before, after)
+    megabytes = float(count*payload_size) / (1024*1024)
+    print("%-24s before %12.1f calls/MB  after %12.1f calls/MB   (%s)" % ("send system calls",beforecalls/megabytes,aftercalls/megabytes,mode))
+
+# count numbered messages each way over one connection. Lockstep is the old
+# way, one thread sending a message and then reading one; duplex streams both
+# directions at once from a sender and a receiver thread. Returns the
+# messages that came out of order or the wrong size.
+# Over loopback on one CPU duplex is no faster than lockstep: 10000
+# messages of 1024 bytes ran at 0.87x to 1.21x of it, 16000 bytes at about
+# 0.9x. Both ends and both threads share the CPU and the GIL, and there is
+# no network latency for the threads to hide. The gain is in overlapping
+# round trips on a real link, which this does not measure.
+def duplex_stream(s,count,payload_size,duplex):
+    filler = b'x' * (payload_size - 4)
+    errors = []
+
+    def send():
+        for i in range(count):
+            s.sendto(st.pack('!L',i) + filler)
+
+    def receive():
+        for i in range(count):
+            message = s.recvfrom(sock352.MAX_SIZE)
+            if (len(message) != payload_size) or (st.unpack('!L',message[:4])[0] != i):
+                errors.append(i)
+
+    if (duplex):
+        threads = [threading.Thread(target=send), threading.Thread(target=receive)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    else:
+        for i in range(count):
+            s.sendto(st.pack('!L',i) + filler)
+            message = s.recvfrom(sock352.MAX_SIZE)
+            if (len(message) != payload_size) or (st.unpack('!L',message[:4])[0] != i):
+                errors.append(i)
+    s.close()
+    return len(errors)
+
+# the other end of the duplex benchmark, the exit code says if it got
+# everything in order
+def duplex_peer(port,count,payload_size,duplex):
+    s = sock352.Socket()
+    s.bind(('127.0.0.1',port))
+    s.accept()
+    if (duplex_stream(s,count,payload_size,duplex) > 0):
+        raise SystemExit(1)
+
+# returns messages/sec each way and whether both ends got them all in order
+def duplex_transfer(count,payload_size,duplex):
+    free = ip.socket(ip.AF_INET,ip.SOCK_DGRAM)
+    free.bind(('127.0.0.1',0))
+    port = free.getsockname()[1]
+    free.close()
+    peer = multiprocessing.Process(target=duplex_peer, args=(port,count,payload_size,duplex))
+    peer.start()
+    time.sleep(0.3)
+
+    s = sock352.Socket()
+    s.bind(('127.0.0.1',0))
+    s.connect(('127.0.0.1',port))
+    start = time.time()
+    errors = duplex_stream(s,count,payload_size,duplex)
+    lapsed = time.time() - start
+    peer.join()
+    return (float(count) / lapsed, (errors == 0) and (peer.exitcode == 0))
+
+def bench_duplex(count,payload_size):
+    (before, beforeok) = duplex_transfer(count,payload_size,False)
+    (after, afterok) = duplex_transfer(count,payload_size,True)
+    report("duplex %d bytes" % payload_size, before, after)
+    print("%-24s before %12s            after %12s" % ("in order both ways",beforeok,afterok))
+
+def main():
+    parser = argparse.ArgumentParser(description='CS 352 Socket micro benchmarks')
+    parser.add_argument('test', help='benchmark to run', choices=['codec','recv','pool','ack','send','duplex'])
+    parser.add_argument('-n','--count', help='Packets per run', default='200000')
+    parser.add_argument('-s','--size', help='Payload size in bytes', default='1024')
+
+    args = vars(parser.parse_args())
+    count = int(args['count'])
+    payload_size = int(args['size'])
+
+    if (args['test'] == 'codec'):
+        bench_codec(count,payload_size)
+    elif (args['test'] == 'recv'):
+        bench_recv(count,payload_size)
+    elif (args['test'] == 'pool'):
+        bench_pool(count)
+    elif (args['test'] == 'ack'):
+        for window in (16,256,4096):
+            bench_ack(window)
+    elif (args['test'] == 'send'):
+        bench_send(count,payload_size)
+    elif (args['test'] == 'duplex'):
+        bench_duplex(count,payload_size)
+
+# this gives a main function in Python
+if __name__ == "__main__":
+    main()